@@ -0,0 +1,485 @@
+"""
+Offline benchmark of the transfer path.
+
+It runs local HTTP servers that imitate the parts of Google Photos
+(mediaItems:search and the =dv download) and YouTube (the resumable upload
+protocol) used by google_photos_to_youtube, with configurable size, bandwidth,
+latency and injected failures, and it migrates the fake library with
+get_videos, MediaStreamUpload and upload_stream (or `--engine asyncio`, the
+AsyncPipeline).
+
+    python benchmark.py --videos 8 --size 32 --workers 4 --readahead 8
+
+Each run prints a json line with the throughput, the latency of the chunk
+uploads, the peak memory and the requests per video, so the knobs (chunk size,
+workers, read-ahead, retries) can be compared with repeatable numbers.
+`test_resumable_protocol()` checks that both engines cope with the parts of the
+protocol that the fake YouTube doesn't exercise by default.
+"""
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import threading
+import time
+import tracemalloc
+import types
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import googleapiclient.http
+import httplib2
+import requests
+
+import google_photos_to_youtube as gp
+
+MiB = 1024 * 1024
+
+
+class Conditions:
+    """Network conditions imposed by the fake servers"""
+
+    def __init__(
+        self, bandwidth=None, latency=0.0, fail_rate=0.0, partial=False, lose_rate=0.0, seed=0
+    ):
+        self.bandwidth = bandwidth  # bytes per second per connection, None is unlimited
+        self.latency = latency  # seconds added to each request
+        self.fail_rate = fail_rate  # probability of failing a request
+        self.partial = partial  # YouTube commits only half of each chunk but the last
+        self.lose_rate = lose_rate  # probability of failing an upload after committing it
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def fails(self, rate=None):
+        with self.lock:
+            return self.random.random() < (self.fail_rate if rate is None else rate)
+
+    def throttle(self, nbytes):
+        if self.bandwidth:
+            time.sleep(nbytes / self.bandwidth)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def count(self):
+        with self.server.lock:
+            self.server.requests += 1
+        time.sleep(self.server.conditions.latency)
+
+    def reply(self, status, body=b"", headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = bytearray()
+        while len(body) < length:
+            block = self.rfile.read(min(64 * 1024, length - len(body)))
+            if not block:
+                break
+            self.server.conditions.throttle(len(block))
+            body += block
+        return bytes(body)
+
+
+class PhotosHandler(_Handler):
+    """mediaItems:search and the =dv download, redirected like the real one"""
+
+    def do_POST(self):
+        self.count()
+        query = json.loads(self.read_body())
+        start = int(query.get("pageToken") or 0)
+        videos = self.server.videos[start : start + query.get("pageSize", 25)]
+        page = {"mediaItems": videos}
+        if start + len(videos) < len(self.server.videos):
+            page["nextPageToken"] = str(start + len(videos))
+        self.reply(200, json.dumps(page).encode(), [("Content-Type", "application/json")])
+
+    def do_GET(self):
+        self.count()
+        path = urllib.parse.unquote(self.path)
+        if path.endswith("=dv"):
+            video_id = path.split("/")[-1][: -len("=dv")]
+            self.reply(302, headers=[("Location", f"/content/{video_id}")])
+            return
+        self.send_content(path.split("/")[-1])
+
+    def send_content(self, video_id):
+        size = self.server.size
+        start = 0
+        match = self.headers.get("Range")
+        if match:
+            start = int(match.split("=")[1].split("-")[0])
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(size - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        self.end_headers()
+        conditions = self.server.conditions
+        position = start
+        while position < size:
+            n = min(64 * 1024, size - position)
+            if conditions.fails():
+                # drop the connection in the middle of the body
+                self.close_connection = True
+                return
+            conditions.throttle(n)
+            self.wfile.write(self.server.content[position : position + n])
+            position += n
+
+
+class YouTubeHandler(_Handler):
+    """The resumable upload protocol of videos.insert"""
+
+    def do_POST(self):
+        self.count()
+        self.read_body()
+        with self.server.lock:
+            session_id = f"session{len(self.server.sessions)}"
+            self.server.sessions[session_id] = {
+                "committed": 0,
+                "size": int(self.headers["X-Upload-Content-Length"]),
+                "sha256": hashlib.sha256(),
+            }
+        host, port = self.server.server_address
+        self.reply(200, headers=[("Location", f"http://{host}:{port}/upload/{session_id}")])
+
+    def do_PUT(self):
+        self.count()
+        body = self.read_body()
+        session_id = self.path.split("/")[-1]
+        session = self.server.sessions[session_id]
+        content_range = self.headers.get("Content-Range", "")
+        conditions = self.server.conditions
+        if conditions.fails():
+            self.reply(503, b'{"error": {"code": 503, "message": "backend error"}}')
+            return
+        if not content_range.startswith("bytes */"):
+            first = int(content_range.split()[1].split("-")[0])
+            if first == session["committed"]:
+                accepted = len(body)
+                if conditions.partial and first + accepted < session["size"]:
+                    # what's committed of a chunk stays a multiple of 256 KiB
+                    half = accepted // 2 // gp.CHUNK_GRANULARITY * gp.CHUNK_GRANULARITY
+                    accepted = half or accepted
+                session["sha256"].update(body[:accepted])
+                session["committed"] += accepted
+            if conditions.fails(conditions.lose_rate):
+                # committed, but the client doesn't hear about it
+                self.reply(503, b'{"error": {"code": 503, "message": "backend error"}}')
+                return
+        if session["committed"] >= session["size"]:
+            self.reply(201, json.dumps({"id": session_id}).encode())
+            return
+        headers = []
+        if session["committed"]:
+            headers.append(("Range", f"bytes=0-{session['committed'] - 1}"))
+        self.reply(308, headers=headers)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the client hanging up in the middle of a body is expected
+        return
+
+
+def serve(handler, conditions, **attributes):
+    server = _Server(("127.0.0.1", 0), handler)
+    server.conditions = conditions
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.__dict__.update(attributes)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class LocalSession(requests.Session):
+    """A session that sends the Photos API requests to the local stand-in"""
+
+    # what AsyncPipeline takes from the sessions of `login`
+    credentials = types.SimpleNamespace(valid=True, token="local")
+
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+
+    def request(self, method, url, *args, **kwargs):
+        url = url.replace("https://photoslibrary.googleapis.com", self.root)
+        return super().request(method, url, *args, **kwargs)
+
+
+class _TimedHttp(httplib2.Http):
+    """Keep the latency of each request of the upload"""
+
+    def __init__(self, latencies):
+        super().__init__()
+        # like googleapiclient.http.build_http, 308 is the resumable "continue"
+        self.redirect_codes = self.redirect_codes - {308}
+        self.latencies = latencies
+
+    def request(self, *args, **kwargs):
+        started = time.monotonic()
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            self.latencies.append(time.monotonic() - started)
+
+
+class FakeYouTube:
+    """Just enough of the googleapiclient resource for upload_stream"""
+
+    def __init__(self, root, latencies):
+        self.root = root
+        self.latencies = latencies
+
+    def videos(self):
+        return self
+
+    def insert(self, part, body, media_body):
+        return googleapiclient.http.HttpRequest(
+            _TimedHttp(self.latencies),
+            lambda response, content: json.loads(content),
+            f"{self.root}/upload/youtube/v3/videos?uploadType=resumable&part={part}",
+            method="POST",
+            body=json.dumps(body),
+            headers={"content-type": "application/json"},
+            resumable=media_body,
+        )
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def _run_asyncio(listed, session, youtube_root, workers, chunksize, readahead, transfer_retry, hub):
+    """Upload the `listed` videos with the AsyncPipeline, `workers` at a time"""
+
+    async def main():
+        youtube = types.SimpleNamespace(_http=types.SimpleNamespace(credentials=session.credentials))
+        async with gp.AsyncPipeline(
+            session, youtube, uploads=workers, chunksize=chunksize, readahead=readahead
+        ) as pipeline:
+            pipeline.photos_api = f"{session.root}/v1"
+            pipeline.upload_url = f"{youtube_root}/upload/youtube/v3/videos"
+            limit = asyncio.Semaphore(workers)
+
+            async def transfer(video):
+                async with limit:
+                    metrics = gp.TransferMetrics(video["id"], hub)
+                    body = {"snippet": {"title": video["filename"]}}
+                    result, _ = await pipeline.upload(
+                        video, body, retry=transfer_retry(), metrics=metrics
+                    )
+                    metrics.finish(result["id"])
+                    return result, metrics.chunks
+
+            return await asyncio.gather(*(transfer(video) for video in listed))
+
+    return asyncio.run(main())
+
+
+ENGINES = ("threads", "asyncio")
+
+
+def run(
+    videos=8,
+    size=16 * MiB,
+    workers=4,
+    chunksize=gp.DEFAULT_CHUNK_SIZE,
+    adaptive=False,
+    readahead=0,
+    conditions=None,
+    retries=20,
+    engine="threads",
+):
+    conditions = conditions or Conditions()
+    content = random.Random(0).randbytes(size)
+    photos = serve(PhotosHandler, conditions, videos=[], size=size, content=content)
+    host, port = photos.server_address
+    photos.videos = [
+        {
+            "id": f"video{i}",
+            "productUrl": f"{gp.PHOTO_URL}video{i}",
+            "baseUrl": f"http://{host}:{port}/media/video{i}",
+            "filename": f"video{i}.mp4",
+            "mimeType": "video/mp4",
+            "mediaMetadata": {"creationTime": "2020-01-01T00:00:00Z"},
+        }
+        for i in range(videos)
+    ]
+    youtube_server = serve(YouTubeHandler, conditions, sessions={})
+    host, port = youtube_server.server_address
+    latencies = []
+    session = LocalSession(f"http://{photos.server_address[0]}:{photos.server_address[1]}")
+    retry_budgets = []
+    summaries = []
+    hub = gp.Metrics()
+    hub.subscribe(lambda event: event["event"] == "finish" and summaries.append(event))
+
+    def transfer_retry():
+        retry = gp.Retry(budget=retries, base=0.05, cap=1.0)
+        retry_budgets.append(retry)
+        return retry
+
+    def transfer(video):
+        retry = transfer_retry()
+        media = gp.MediaStreamUpload(
+            retry.call(gp.get_stream, session, video),
+            reopen=lambda offset: gp.get_stream(session, video, offset),
+            retry=retry,
+            chunksize=chunksize,
+            adaptive=adaptive,
+            readahead=readahead,
+            metrics=gp.TransferMetrics(video["id"], hub),
+        )
+        youtube = FakeYouTube(f"http://{host}:{port}", latencies)
+        return gp.upload_stream(youtube, media, title=video["filename"], retry=retry)
+
+    tracemalloc.start()
+    started = time.monotonic()
+    listed = list(gp.iter_videos(session))
+    if engine == "asyncio":
+        results = _run_asyncio(
+            listed,
+            session,
+            f"http://{host}:{port}",
+            workers,
+            chunksize,
+            readahead,
+            transfer_retry,
+            hub,
+        )
+        for _, chunks in results:
+            latencies.extend(chunks)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(transfer, listed))
+    elapsed = time.monotonic() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    photos.shutdown()
+    youtube_server.shutdown()
+
+    assert len(results) == videos
+    expected = hashlib.sha256(content).hexdigest()
+    for session_id, upload in youtube_server.sessions.items():
+        if upload["committed"] >= upload["size"]:
+            assert upload["sha256"].hexdigest() == expected, f"{session_id} got other bytes"
+    return {
+        "engine": engine,
+        "videos": videos,
+        "size_mib": size / MiB,
+        "workers": workers,
+        "chunk_mib": chunksize / MiB,
+        "adaptive": adaptive,
+        "readahead_mib": readahead / MiB,
+        "fail_rate": conditions.fail_rate,
+        "seconds": round(elapsed, 3),
+        "mib_per_second": round(videos * size / MiB / elapsed, 2),
+        "chunk_latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 1),
+            "p90": round(percentile(latencies, 0.9) * 1000, 1),
+            "max": round(max(latencies, default=0) * 1000, 1),
+        },
+        "peak_memory_mib": round(peak / MiB, 1),
+        "requests_per_video": {
+            "photos": round(photos.requests / videos, 1),
+            "youtube": round(youtube_server.requests / videos, 1),
+        },
+        "retries": sum(retry.spent for retry in retry_budgets),
+        "bytes_resent": hub.counters["resent_bytes_total"],
+        # seconds the uploads spent on each stage, summed over the videos
+        "stages": {
+            "download": round(hub.counters["wait_seconds_total"], 3),
+            "buffering": round(hub.counters["buffer_seconds_total"], 3),
+            "upload": round(hub.counters["upload_seconds_total"], 3),
+        },
+        "bound_by": collections.Counter(s["bound_by"] for s in summaries),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--videos", type=int, default=8)
+    parser.add_argument("--size", type=float, default=16, help="MiB per video")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=float, default=1, help="MiB")
+    parser.add_argument("--adaptive", action="store_true")
+    parser.add_argument("--readahead", type=float, default=0, help="MiB")
+    parser.add_argument(
+        "--bandwidth", type=float, help="MiB/s per connection, unlimited by default"
+    )
+    parser.add_argument("--latency", type=float, default=0, help="ms per request")
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument(
+        "--partial", action="store_true", help="YouTube commits only half of each chunk"
+    )
+    parser.add_argument(
+        "--lose-rate", type=float, default=0, help="uploads failed after being committed"
+    )
+    parser.add_argument("--retries", type=int, default=20, help="retry budget per video")
+    parser.add_argument("--engine", choices=ENGINES, default="threads")
+    args = parser.parse_args(argv)
+
+    conditions = Conditions(
+        bandwidth=args.bandwidth * MiB if args.bandwidth else None,
+        latency=args.latency / 1000,
+        fail_rate=args.fail_rate,
+        partial=args.partial,
+        lose_rate=args.lose_rate,
+    )
+    result = run(
+        videos=args.videos,
+        size=int(args.size * MiB),
+        workers=args.workers,
+        chunksize=int(args.chunk_size * MiB),
+        adaptive=args.adaptive,
+        readahead=int(args.readahead * MiB),
+        conditions=conditions,
+        retries=args.retries,
+        engine=args.engine,
+    )
+    print(json.dumps(result))
+
+
+def test_resumable_protocol(timeout=60):
+    """
+    Test that both engines finish uploads when YouTube commits chunks in part,
+    and when a request fails after YouTube committed it (the last one included)
+    """
+    ok = True
+    for engine in ENGINES:
+        conditions = Conditions(partial=True, lose_rate=0.3, seed=1)
+        worker = ThreadPoolExecutor(max_workers=1)
+        future = worker.submit(
+            run, videos=3, size=3 * MiB + 12345, workers=3, conditions=conditions, engine=engine
+        )
+        try:
+            result = future.result(timeout)
+        except Exception as e:
+            print(f"❌ {engine}: {e!r}")
+            ok = False
+        else:
+            print(f"✅ {engine}: {result['retries']} retries")
+        # a stuck engine is left behind, its thread is a daemon
+        worker.shutdown(wait=False)
+    return ok
+
+
+if __name__ == "__main__":
+    main()
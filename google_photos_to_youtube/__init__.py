@@ -0,0 +1,60 @@
+"""
+Migrate videos from Google Photos to YouTube.
+
+The transfer engine is in `core`, the OAuth login in `auth`, the asyncio engine
+in `aio`, the notebook widgets in `ui`, the command line in `cli` and the checks
+of the package in `selftest`. Only the
+core is imported up front. The rest (and IPython, ipywidgets, aiohttp and the
+OAuth flow) is imported the first time one of its names is used, so headless
+workers don't pay for them. `from google_photos_to_youtube import *` still
+brings everything.
+"""
+import importlib
+
+from .core import *
+from .core import __all__ as _core_names
+
+_LAZY = {
+    "auth": (
+        "create_client_id",
+        "OAuthCallbackHandler",
+        "extract_code_from_url",
+        "test_url_parsing",
+        "is_colab_environment",
+        "get_authorization_code",
+        "debug_scopes",
+        "CREDENTIALS_DIR",
+        "credentials_path",
+        "save_credentials",
+        "load_credentials",
+        "photos_session",
+        "login",
+    ),
+    "aio": (
+        "AsyncPipeline",
+        "amigrate",
+    ),
+    "ui": (
+        "video_block",
+        "load_page",
+        "VideoGrid",
+    ),
+    "cli": ("main",),
+    "selftest": ("test_import_time",),
+}
+_MODULES = {name: module for module, names in _LAZY.items() for name in names}
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_MODULES[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_MODULES])
+
+
+__all__ = [*_core_names, *_MODULES]
@@ -0,0 +1,499 @@
+"""asyncio version of the migration engine, it needs aiohttp"""
+import asyncio
+import hashlib
+import time
+
+from google.auth.transport.requests import Request
+
+from .core import (
+    BANDWIDTH,
+    CHUNK_GRANULARITY,
+    DB,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_TAGS,
+    MAX_PAGE_SIZE,
+    RETRIABLE_EXCEPTIONS,
+    YOUTUBE_URL,
+    Retry,
+    TransferMetrics,
+    _is_video,
+    _matching,
+    _search_query,
+    _video_body,
+    default_description,
+    default_title,
+    fingerprint,
+    stream_offset,
+    stream_size,
+)
+
+__all__ = [
+    "AsyncPipeline",
+    "amigrate",
+]
+
+
+def _aiohttp():
+    """aiohttp is only needed by the asyncio engine, so it's imported on demand"""
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError("the asyncio engine requires aiohttp: pip install aiohttp") from None
+    if aiohttp.ClientError not in RETRIABLE_EXCEPTIONS:
+        # failed connections and truncated bodies (http errors go by their status)
+        RETRIABLE_EXCEPTIONS.extend(
+            [aiohttp.ClientError, asyncio.TimeoutError, asyncio.IncompleteReadError]
+        )
+    return aiohttp
+
+
+async def _throttle(direction, nbytes):
+    """`BANDWIDTH.take` off the event loop, only when there's a limit"""
+    if BANDWIDTH.limited(direction):
+        await asyncio.to_thread(BANDWIDTH.take, direction, nbytes)
+
+
+async def _throttled(data):
+    """Yield the pieces of `data` as the upload limit lets them be written"""
+    quantum = BANDWIDTH.buckets["upload"].quantum
+    for start in range(0, len(data), quantum):
+        piece = data[start : start + quantum]
+        await _throttle("upload", len(piece))
+        yield piece
+
+
+async def _aiter(videos):
+    if hasattr(videos, "__aiter__"):
+        async for video in videos:
+            yield video
+    else:
+        for video in videos:
+            yield video
+
+
+async def _aselect(session, videos, where, db):
+    """The `videos` not in `db` matching `where`, sized a page at a time in a thread"""
+    batch = []
+    async for video in _aiter(videos):
+        if video["productUrl"] not in db:
+            batch.append(video)
+        if len(batch) == MAX_PAGE_SIZE:
+            for match in await asyncio.to_thread(_matching, session, batch, where):
+                yield match
+            batch = []
+    for match in await asyncio.to_thread(_matching, session, batch, where):
+        yield match
+
+
+class AsyncPipeline:
+    """
+    asyncio version of the migration engine, to run many transfers on a single
+    event loop (like the one already running in Jupyter)::
+
+        async with AsyncPipeline(session, youtube) as pipeline:
+            results = await pipeline.migrate()
+
+    It speaks HTTP through aiohttp with the credentials of the `login` clients,
+    streaming each download into a resumable upload with up to `readahead` bytes
+    downloaded ahead. Every stage has its own semaphore: concurrent `transfers`,
+    chunk `downloads`, chunk `uploads`, `metadata` calls (listing, upload
+    sessions) and `database` updates.
+    Unless `dedupe` is False, likely duplicates of migrated videos are linked to
+    them instead of uploaded, like `migrate_video` does. The transfers follow the
+    limits of `BANDWIDTH`.
+    """
+
+    photos_api = "https://photoslibrary.googleapis.com/v1"
+    upload_url = "https://www.googleapis.com/upload/youtube/v3/videos"
+
+    def __init__(
+        self,
+        session,
+        youtube,
+        transfers=32,
+        downloads=16,
+        uploads=8,
+        metadata=4,
+        database=1,
+        chunksize=4 * DEFAULT_CHUNK_SIZE,
+        readahead=4 * DEFAULT_CHUNK_SIZE,
+        dedupe=True,
+    ):
+        self.aiohttp = _aiohttp()
+        self.session = session
+        self.photos_credentials = session.credentials
+        self.youtube_credentials = youtube._http.credentials
+        # every chunk but the last must be a multiple of 256 KiB
+        self.chunksize = max(CHUNK_GRANULARITY, chunksize // CHUNK_GRANULARITY * CHUNK_GRANULARITY)
+        self.readahead = readahead
+        self.dedupe = dedupe
+        self.stages = {
+            "transfers": asyncio.Semaphore(transfers),
+            "downloads": asyncio.Semaphore(downloads),
+            "uploads": asyncio.Semaphore(uploads),
+            "metadata": asyncio.Semaphore(metadata),
+            "database": asyncio.Semaphore(database),
+        }
+        self.http = None
+
+    async def __aenter__(self):
+        aiohttp = self.aiohttp
+        self.http = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300),
+            # the semaphores are the limits
+            connector=aiohttp.TCPConnector(limit=0),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.http.close()
+
+    async def _headers(self, credentials):
+        if not credentials.valid:
+            # google-auth refreshes with a blocking request
+            await asyncio.to_thread(credentials.refresh, Request())
+        return {"Authorization": f"Bearer {credentials.token}"}
+
+    async def _json(self, method, url, **kwargs):
+        """A call to the Photos API, retried on transient errors"""
+
+        async def attempt():
+            headers = await self._headers(self.photos_credentials)
+            async with self.stages["metadata"]:
+                async with self.http.request(method, url, headers=headers, **kwargs) as r:
+                    r.raise_for_status()
+                    return await r.json(content_type=None)
+
+        return await Retry().acall(attempt)
+
+    async def iter_videos(self, page_size=MAX_PAGE_SIZE, filters=None, album_id=None, where=None):
+        """Async generator of the videos of the library, see `iter_pages` for the filters"""
+        token = None
+        while True:
+            page = await self._json(
+                "POST",
+                f"{self.photos_api}/mediaItems:search",
+                json=_search_query(token, page_size, filters, album_id),
+            )
+            videos = page.get("mediaItems", [])
+            if album_id:
+                videos = [video for video in videos if _is_video(video)]
+            if where is not None:
+                # sizing them for `where` takes blocking requests
+                videos = await asyncio.to_thread(_matching, self.session, videos, where)
+            for video in videos:
+                yield video
+            token = page.get("nextPageToken")
+            if not token:
+                return
+
+    async def get_media_item(self, item_id):
+        return await self._json("GET", f"{self.photos_api}/mediaItems/{item_id}")
+
+    async def _download(self, video, offset, metrics):
+        """Open the download of `video` from `offset` on"""
+        headers = await self._headers(self.photos_credentials)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        started = time.monotonic()
+        # aiohttp drops the Authorization header on the redirects to other hosts
+        response = await self.http.get(f"{video['baseUrl']}=dv", headers=headers)
+        if response.status == 403:
+            # the baseUrl expired during a long transfer
+            response.release()
+            video.update(await self.get_media_item(video["id"]))
+            response = await self.http.get(f"{video['baseUrl']}=dv", headers=headers)
+        if not response.ok:
+            response.release()
+            response.raise_for_status()
+        metrics.on_connect(time.monotonic() - started, stream_offset(response))
+        return response
+
+    async def _read_chunks(self, video, response, size, retry, metrics, chunks):
+        """
+        Put the download in the `chunks` queue as (offset, bytes) pieces of
+        `self.chunksize`, reconnecting with a Range request after errors.
+        A failure is put in the queue too.
+        """
+        offset = stream_offset(response)
+
+        async def read():
+            nonlocal response
+            if response is None:
+                response = await self._download(video, offset, metrics)
+                # skip what's before the offset (e.g. the server ignored the Range)
+                position = stream_offset(response)
+                while position < offset:
+                    skipped = await response.content.readexactly(
+                        min(self.chunksize, offset - position)
+                    )
+                    position += len(skipped)
+            async with self.stages["downloads"]:
+                return await response.content.readexactly(min(self.chunksize, size - offset))
+
+        async def reconnect(error):
+            nonlocal response
+            metrics.on_retry("download", error)
+            if response is not None:
+                response.release()
+                response = None
+
+        try:
+            while offset < size:
+                started = time.monotonic()
+                data = await retry.acall(read, on_retry=reconnect)
+                await _throttle("download", len(data))
+                metrics.on_download(len(data), time.monotonic() - started)
+                await chunks.put((offset, data))
+                offset += len(data)
+        except Exception as e:
+            await chunks.put(e)
+        finally:
+            if response is not None:
+                response.release()
+
+    async def _create_session(self, body, size, mimetype):
+        """Start a resumable upload and return its uri"""
+        headers = {
+            **await self._headers(self.youtube_credentials),
+            "X-Upload-Content-Length": str(size),
+            "X-Upload-Content-Type": mimetype,
+        }
+        params = {"uploadType": "resumable", "part": ",".join(body)}
+        async with self.stages["metadata"]:
+            async with self.http.post(
+                self.upload_url, params=params, json=body, headers=headers
+            ) as response:
+                response.raise_for_status()
+                return response.headers["Location"]
+
+    async def _put(self, uri, size, offset=None, data=None):
+        """
+        Send `data` at `offset` to the upload session, or just ask for its status
+        without `data`. Return the committed offset and the video once it's complete.
+        """
+        headers = await self._headers(self.youtube_credentials)
+        if data is None:
+            headers["Content-Range"] = f"bytes */{size}"
+        else:
+            headers["Content-Range"] = f"bytes {offset}-{offset + len(data) - 1}/{size}"
+            if BANDWIDTH.limited("upload"):
+                # taken while the body is written, not up front and then in a burst
+                headers["Content-Length"] = str(len(data))
+                data = _throttled(data)
+        async with self.stages["metadata" if data is None else "uploads"]:
+            async with self.http.put(
+                uri, data=b"" if data is None else data, headers=headers, allow_redirects=False
+            ) as response:
+                if response.status == 308:
+                    # "Range: bytes=0-<last committed byte>", missing if there's none
+                    committed = response.headers.get("Range")
+                    return (int(committed.rsplit("-", 1)[1]) + 1 if committed else 0), None
+                response.raise_for_status()
+                return size, await response.json(content_type=None)
+
+    async def upload(self, video, body, response=None, retry=None, metrics=None):
+        """
+        Stream the download of `video` (or its open `response`) into a resumable
+        upload with the metadata `body`. Return the inserted video and the sha256
+        of its bytes.
+        """
+        retry = retry or Retry()
+        metrics = metrics or TransferMetrics(video["id"])
+        if response is None:
+            response = await retry.acall(self._download, video, 0, metrics)
+        size = stream_size(response)
+        digest = hashlib.sha256()
+        chunks = asyncio.Queue(maxsize=max(1, self.readahead // self.chunksize))
+        reader = asyncio.create_task(
+            self._read_chunks(video, response, size, retry, metrics, chunks)
+        )
+        try:
+            uri = await retry.acall(
+                self._create_session, body, size, response.headers["Content-Type"]
+            )
+            committed = 0
+            stale = False  # the committed offset must be asked after a failure
+            result = None
+
+            async def send(offset, data):
+                nonlocal committed, stale, result
+                if stale:
+                    committed, result = await self._put(uri, size)
+                    stale = False
+                    if result is not None:
+                        # the failed request completed the upload anyway
+                        return
+                if committed < offset:
+                    raise RuntimeError(f"the upload session lost bytes {committed}-{offset}")
+                piece = memoryview(data)[committed - offset :]
+                metrics.on_buffer(committed, len(piece), 0.0, 0.0)
+                committed, result = await self._put(uri, size, committed, piece)
+
+            async def on_error(error):
+                nonlocal stale
+                metrics.on_retry("upload", error)
+                stale = True
+
+            while result is None:
+                waiting = time.monotonic()
+                item = await chunks.get()
+                if isinstance(item, Exception):
+                    raise item
+                offset, data = item
+                digest.update(data)
+                waited = time.monotonic() - waiting
+                metrics.on_buffer(offset, 0, waited, waited)
+                # YouTube may commit only part of a chunk, the rest is sent again
+                while result is None and committed < offset + len(data):
+                    started = time.monotonic()
+                    sent = metrics.sent
+                    await retry.acall(send, offset, data, on_retry=on_error)
+                    metrics.on_chunk(time.monotonic() - started, 0.0, metrics.sent - sent, committed)
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+        return result, digest.hexdigest()
+
+    async def migrate_video(
+        self,
+        video,
+        title=None,
+        description=None,
+        privacy_status="private",
+        tags=DEFAULT_TAGS,
+    ):
+        """Transfer a single video from Google Photos to YouTube and record it in the DB"""
+        retry = Retry()
+        metrics = TransferMetrics(video["id"])
+        body = _video_body(
+            title or default_title(video),
+            default_description(video) if description is None else description,
+            privacy_status,
+            tags,
+        )
+        response = await retry.acall(self._download, video, 0, metrics)
+        size = stream_size(response)
+        # the first DB of the process lists the album
+        db = await asyncio.to_thread(DB, self.session)
+        if self.dedupe:
+            async with self.stages["database"]:
+                duplicate = await asyncio.to_thread(
+                    db.find_duplicate, fingerprint=fingerprint(video, size)
+                )
+            if duplicate:
+                response.release()
+                print(f"🔗 {default_title(video)} is a duplicate of {duplicate[0]}")
+                async with self.stages["database"]:
+                    await asyncio.to_thread(db.__setitem__, video["productUrl"], duplicate[1])
+                return duplicate[1]
+        metrics.start(size)
+        try:
+            result, content_hash = await self.upload(video, body, response, retry, metrics)
+            url = f"{YOUTUBE_URL}{result['id']}"
+            async with self.stages["database"]:
+                first = self.dedupe and await asyncio.to_thread(
+                    db.find_duplicate, content_hash=content_hash
+                )
+                if first:
+                    # the fingerprint missed it, YouTube rejects the second upload of a file
+                    print(
+                        f"🔗 {default_title(video)} has the same bytes as {first[0]}, "
+                        f"{url} will be rejected as a duplicate"
+                    )
+                    url = first[1]
+                await asyncio.to_thread(db.__setitem__, video["productUrl"], url)
+                await asyncio.to_thread(
+                    db.set_content, video["productUrl"], content_hash, fingerprint(video, size)
+                )
+        except Exception as e:
+            metrics.finish(error=e)
+            raise
+        metrics.finish(url)
+        return url
+
+    async def migrate(
+        self,
+        videos=None,
+        privacy_status="private",
+        tags=DEFAULT_TAGS,
+        limit=None,
+        filters=None,
+        album_id=None,
+        where=None,
+    ):
+        """
+        Transfer every video of the library (or of `videos`, an iterable or an
+        async iterable) not in the DB yet. `filters`, `album_id` and `where`
+        narrow them down like in `migrate`. Return a dict mapping the gphoto url
+        to the youtube url, or to the exception raised while migrating it.
+        """
+        # loading the DB may need the network
+        db = await asyncio.to_thread(DB, self.session)
+        if videos is None:
+            videos = self.iter_videos(filters=filters, album_id=album_id)
+        if where is not None:
+            # the migrated ones aren't sized for nothing
+            videos = _aselect(self.session, videos, where, db)
+        results = {}
+        tasks = set()
+
+        async def work(video):
+            try:
+                results[video["productUrl"]] = await self.migrate_video(
+                    video, privacy_status=privacy_status, tags=tags
+                )
+                print(f"✅ {default_title(video)} -> {results[video['productUrl']]}")
+            except Exception as e:
+                results[video["productUrl"]] = e
+                print(f"❌ {default_title(video)} failed: {e}")
+            finally:
+                self.stages["transfers"].release()
+
+        submitted = 0
+        db.write_behind()
+        try:
+            async for video in _aiter(videos):
+                if limit is not None and submitted >= limit:
+                    break
+                if video["productUrl"] in db:
+                    continue
+                # stop listing while all the transfers are busy
+                await self.stages["transfers"].acquire()
+                task = asyncio.create_task(work(video))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                submitted += 1
+            await asyncio.gather(*tasks)
+        finally:
+            # joining the flusher and the last flush would block the event loop
+            await asyncio.to_thread(db.stop_write_behind)
+        return results
+
+
+async def amigrate(
+    session,
+    youtube,
+    videos=None,
+    privacy_status="private",
+    tags=DEFAULT_TAGS,
+    limit=None,
+    filters=None,
+    album_id=None,
+    where=None,
+    **stages,
+):
+    """
+    `migrate` on asyncio, e.g. `await amigrate(session, youtube)` in a notebook.
+    `stages` are the concurrency limits and buffer sizes of `AsyncPipeline`.
+    """
+    async with AsyncPipeline(session, youtube, **stages) as pipeline:
+        return await pipeline.migrate(
+            videos,
+            privacy_status=privacy_status,
+            tags=tags,
+            limit=limit,
+            filters=filters,
+            album_id=album_id,
+            where=where,
+        )
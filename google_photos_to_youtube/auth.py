@@ -1,6 +1,8 @@
-import collections.abc
+"""
+OAuth login to Google Photos and YouTube. The credentials are saved, so later
+logins refresh them instead of asking again.
+"""
 import getpass
-import http.client as httplib
 import json
 import os
 import socket
@@ -10,15 +12,27 @@ import webbrowser
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 
-from IPython.display import Markdown, display
-
-import apiclient.http
-import googleapiclient.errors
-import httplib2
-import ipywidgets as widgets
-from google.auth.transport.requests import AuthorizedSession
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
+import google.auth.exceptions
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2.credentials import Credentials
+
+from .core import POOL_SIZE, size_pool, youtube_client
+
+__all__ = [
+    "create_client_id",
+    "OAuthCallbackHandler",
+    "extract_code_from_url",
+    "test_url_parsing",
+    "is_colab_environment",
+    "get_authorization_code",
+    "debug_scopes",
+    "CREDENTIALS_DIR",
+    "credentials_path",
+    "save_credentials",
+    "load_credentials",
+    "photos_session",
+    "login",
+]
 
 
 def create_client_id():
@@ -246,7 +260,73 @@ def debug_scopes(session):
         print(f"Debug error: {e}")
 
 
-def login(service):
+# where `login` keeps the credentials, to refresh them instead of asking again
+CREDENTIALS_DIR = (
+    Path(os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config")
+    / "google-photos-to-youtube"
+)
+
+
+def credentials_path(service, account="default"):
+    return CREDENTIALS_DIR / f"{service}-{account}.json"
+
+
+def save_credentials(path, credentials):
+    """Write the credentials (refresh token included) readable only by the user"""
+    path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(credentials.to_json())
+    os.replace(tmp, path)
+
+
+def load_credentials(path, scopes):
+    """
+    Return the credentials cached in `path`, refreshed if the access token
+    expired, or None if there are none that grant `scopes` or they were revoked.
+    """
+    try:
+        credentials = Credentials.from_authorized_user_file(str(path))
+    except (OSError, ValueError):
+        return None
+    if not credentials.has_scopes(scopes):
+        return None
+    if not credentials.valid:
+        try:
+            credentials.refresh(Request())
+        except google.auth.exceptions.RefreshError as e:
+            print(f"⚠️  The saved credentials can't be refreshed ({e}), login again")
+            return None
+        except google.auth.exceptions.TransportError:
+            # offline for now, the client refreshes them on its first request
+            return credentials
+        save_credentials(path, credentials)
+    return credentials
+
+
+def photos_session(credentials, connections=POOL_SIZE):
+    session = AuthorizedSession(credentials)
+    size_pool(session, connections)
+    return session
+
+
+def _client(service, credentials):
+    if service == "youtube":
+        return youtube_client(credentials)
+    else:
+        return photos_session(credentials)
+
+
+def login(service, account="default", cache=True):
+    """
+    Return an authorized client for `service`: a YouTube resource for "youtube",
+    an `AuthorizedSession` for "photos".
+
+    The credentials of each service and `account` are saved in `CREDENTIALS_DIR`,
+    so later logins just refresh them, without a browser. The consent flow only
+    runs the first time, when they are revoked, or if `cache` is False.
+    """
     scopes = {
         "photos": [
             "https://www.googleapis.com/auth/photoslibrary",
@@ -256,9 +336,19 @@ def login(service):
             "https://www.googleapis.com/auth/photoslibrary.appendonly",
             "https://www.googleapis.com/auth/photoslibrary.readonly.appcreateddata",
         ],
-        "youtube": ["https://www.googleapis.com/auth/youtube.upload"],
+        "youtube": [
+            "https://www.googleapis.com/auth/youtube.upload",
+            # to check the processing status of the uploads, see `Verifier`
+            "https://www.googleapis.com/auth/youtube.readonly",
+        ],
     }
 
+    path = credentials_path(service, account)
+    if cache:
+        credentials = load_credentials(path, scopes[service])
+        if credentials:
+            return _client(service, credentials)
+
     # Find available port (skip if in Colab)
     port = 8080
     if not is_colab_environment():
@@ -277,6 +367,8 @@ def login(service):
     redirect_uri = f"http://localhost:{port}"
 
     # Create the flow using the client secrets file from the Google API
+    from google_auth_oauthlib.flow import Flow
+
     flow = Flow.from_client_secrets_file(
         "client_id.json",
         scopes=scopes[service],
@@ -312,336 +404,5 @@ def login(service):
                 print(f"OAuth flow failed after {max_retries} attempts: {e}")
                 raise
 
-    if service == "youtube":
-        return build("youtube", "v3", credentials=flow.credentials)
-    else:
-        return AuthorizedSession(flow.credentials)
-
-
-def create_db_image(session, album_id):
-    data = Path("db_image.webp").read_bytes()
-    result = session.post(
-        "https://photoslibrary.googleapis.com/v1/uploads",
-        data,
-        headers={
-            "Content-type": "application/octet-stream",
-            "X-Goog-Upload-Content-Type": "image/webp",
-            "X-Goog-Upload-Protocol": "raw",
-        },
-    )
-    token = result.content.decode()
-
-    payload = {
-        "newMediaItems": [
-            {"description": "{}", "simpleMediaItem": {"uploadToken": token}}
-        ],
-    }
-    if album_id:
-        payload["albumId"] = album_id
-
-    response = session.post(
-        "https://photoslibrary.googleapis.com/v1/mediaItems:batchCreate", json=payload
-    )
-
-    return response.json()["newMediaItemResults"][0]["mediaItem"]
-
-
-class DB(collections.abc.MutableMapping):
-    """
-    A Borg (shared state) dict-like object to permanently store already migrated videos.
-    It maps gphoto url to youtube urls.
-
-    It's stored as a json blob in the description of the first item of the
-    album "migrated-to-youtube" that's created if needed.
-
-    This is a workaround to the limitations of the Goole Photos API
-    that doesn't allow to delete or update the description of items that weren't
-    created by the app, nor add them to a custom album.
-    """
-    _shared_state = {}
-
-    def __init__(self, session):
-        self.__dict__ = self._shared_state
-        if not self._shared_state:
-            self.session = session
-            self.item = self._get_or_create_db()
-            self.data = json.loads(self.item.get("description", "{}"))
-
-    def __getitem__(self, key):
-        return self.data[key]
-
-    def __setitem__(self, key, value):
-        self.data[key] = value
-        self._commit()
-
-    def __delitem__(self, key):
-        del self.data[key]
-        self._commit()
-
-    def __len__(self):
-        return len(self.data)
-
-    def __iter__(self):
-        yield from self.data
-
-    def _commit(self):
-        self.session.patch(
-            f"https://photoslibrary.googleapis.com/v1/mediaItems/{self.item['id']}?updateMask=description",
-            json={"description": json.dumps(self.data, indent=2)},
-        )
-
-    def _get_or_create_db(self):
-        """
-        return the MediaItem dict of the image that's store our db.
-        If the album doesn't exist, it's created and an image is uploaded.
-        """
-        result = self.session.get(
-            "https://photoslibrary.googleapis.com/v1/albums",
-            params={"excludeNonAppCreatedData": True},
-        )
-        for album in result.json().get("albums", []):
-            if album["title"] == "migrated-to-youtube":
-
-                result = self.session.post(
-                    "https://photoslibrary.googleapis.com/v1/mediaItems:search",
-                    json={"albumId": album["id"]},
-                )
-                return result.json()["mediaItems"][0]
-        else:
-            album = self.session.post(
-                "https://photoslibrary.googleapis.com/v1/albums",
-                json={"album": {"title": "migrated-to-youtube"}},
-            ).json()
-            return create_db_image(self.session, album["id"])
-
-    def _repr_html_(self):
-        html = ["<table width=100%>"]
-        for key, value in self.items():
-            html.append("<tr><th>Google Photos</th><th>Youtube</th></tr>")
-            html.append("<tr>")
-            html.append(f"<td><a href='{key}'>{key}</a></td>")
-            html.append(f"<td><a href='{value}'>{value}</a></td>")
-            html.append("</tr>")
-        html.append("</table>")
-        return ''.join(html)
-
-
-def get_videos(session, token=None, page_size=50):
-    q = {
-        "pageSize": page_size,
-        "filters": {"mediaTypeFilter": {"mediaTypes": ["VIDEO"]}},
-    }
-    if token:
-        q["pageToken"] = token
-    return session.post(
-        "https://photoslibrary.googleapis.com/v1/mediaItems:search", json=q
-    ).json()
-
-
-def get_stream(session, video):
-    return session.get(f"{video['baseUrl']}=dv", stream=True)
-
-
-def get_size(session, video):
-    return int(
-        session.head(f"{video['baseUrl']}=dv", allow_redirects=True).headers[
-            "Content-Length"
-        ]
-    )
-
-
-DEFAULT_CHUNK_SIZE = 1024 * 1024
-
-
-def upload_stream(
-    youtube,
-    stream,
-    title,
-    description="",
-    privacy_status="private",  # "unlisted", "public"
-    tags=(),
-    progress=None,
-):
-    body = {
-        "snippet": {
-            "title": title,
-            "description": description,
-            "tags": list(tags),
-        },
-        "status": {
-            "privacyStatus": privacy_status,
-        },
-    }
-    body_keys = ",".join(body.keys())
-
-    media = MediaStreamUpload(stream)
-    request = youtube.videos().insert(part=body_keys, body=body, media_body=media)
-
-    while True:
-        status, response = request.next_chunk()
-        if status and progress:
-            progress.value += DEFAULT_CHUNK_SIZE
-        if response:
-            progress.value = progress.max
-            return f"https://youtu.be/{response['id']}"
-
-
-# TODO retry when any of this exceptions happen
-RETRIABLE_EXCEPTIONS = [
-    socket.error,
-    IOError,
-    httplib2.HttpLib2Error,
-    httplib.NotConnected,
-    httplib.IncompleteRead,
-    httplib.ImproperConnectionState,
-    httplib.CannotSendRequest,
-    httplib.CannotSendHeader,
-    httplib.ResponseNotReady,
-    httplib.BadStatusLine,
-    googleapiclient.errors.HttpError,
-]
-
-
-class MediaStreamUpload(apiclient.http.MediaUpload):
-    def __init__(self, stream, chunksize=DEFAULT_CHUNK_SIZE, resumable=True):
-
-        super(MediaStreamUpload, self).__init__()
-
-        self._stream = stream
-        self._mimetype = stream.headers["content-type"]
-        self._resumable = resumable
-        if not (chunksize == -1 or chunksize > 0):
-            raise ValueError("invalid chunksize error")
-        self._chunksize = chunksize
-        self._size = int(stream.headers["Content-Length"])
-
-        self._iter = stream.iter_content(chunk_size=chunksize)
-        self._cursor = None
-        self._current_buffer = b""
-
-    def chunksize(self):
-        return self._chunksize
-
-    def mimetype(self):
-        return self._mimetype
-
-    def size(self):
-        return self._size
-
-    def resumable(self):
-        return self._resumable
-
-    def getbytes(self, begin, length):
-        if self._cursor != begin:
-            self._cursor = begin
-            self._current_buffer = next(self._iter)
-        return self._current_buffer
-
-    def has_stream(self):
-        return False  # True
-
-    def to_json(self):
-        """This upload type is not serializable."""
-        raise NotImplementedError("MediaIoBaseUpload is not serializable.")
-
-
-def video_block(video, session, youtube):
-    title = widgets.Text(
-        value=video.get("description", ""),
-        description="Title",
-        disabled=False,
-    )
-    title.layout.width = "30em"
-    description = widgets.Textarea(
-        value="\n - ".join(
-            [
-                "",
-                "Migrado desde Google Photos con http://github.com/mgaitan/google-photos-to-youtube",
-                f"Fecha de subida original: {video['mediaMetadata']['creationTime']}",
-                f"Google photo ID:  {video['id']}",
-                f"Url original:  {video['productUrl']}",
-            ]
-        ),
-        description="Description",
-        disabled=False,
-    )
-    description.layout.height = "6em"
-    description.layout.width = "30em"
-    privacy = widgets.Dropdown(
-        options=["private", "unlisted", "public"],
-        value="private",
-        description='Privacy status:',
-        disabled=False,
-    )
-    privacy.layout.width = "30em"
-    tags = widgets.Text(
-        value="google-photos-to-youtube, ",
-        description="Tags",
-        disabled=False,
-    )
-    tags.layout.width = "30em"
-    output = widgets.Output()
-    button = widgets.Button(description="Upload to youtube!")
-
-    thumb = Markdown(f"[![]({video['baseUrl']}=w300-h300-no)]({video['productUrl']})")
-    display(thumb, title, description, privacy, tags, button, output)
-
-    def on_button_clicked(b):
-        video_title = title.value.strip()
-        if not video_title:
-            title.placeholder = "This field is required"
-            try:
-                title.focus()
-            except AttributeError:
-                # requires ipython >=8.0
-                # https://github.com/jupyter-widgets/ipywidgets/commit/8b1abab
-                pass
-            return
-
-        with output:
-            bar = widgets.IntProgress(
-                value=0,
-                min=0,
-                max=get_size(session, video),
-                description="Uploading:",
-                bar_style="info",
-                orientation="horizontal",
-            )
-            display(bar)
-            stream = get_stream(session, video)
-            response = upload_stream(
-                youtube,
-                stream,
-                title=video_title,
-                description=description.value,
-                tags=[t.strip() for t in tags.value.split(",")],
-                privacy_status=privacy.value,
-                progress=bar,
-            )
-            print(response)
-
-            # update DB
-            db = DB(session)
-            db[video["productUrl"]] = response
-
-    button.on_click(on_button_clicked)
-
-
-def load_page(session, youtube, token=None):
-    db = DB(session)
-    videos = get_videos(session, token)
-    for video in videos["mediaItems"]:
-        item_url = video["productUrl"]
-        if item_url not in db:
-            video_block(video, session, youtube)
-
-    button = widgets.Button(description="Load more...")
-    output = widgets.Output()
-
-    def next_page(b):
-        button.close()
-        with output:
-            load_page(session, youtube, token=videos["nextPageToken"])
-
-    button.on_click(next_page)
-    display(output, button)
+    save_credentials(path, flow.credentials)
+    return _client(service, flow.credentials)
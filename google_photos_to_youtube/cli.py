@@ -0,0 +1,371 @@
+"""Command line interface, see `python -m google_photos_to_youtube --help`"""
+import argparse
+import datetime
+import json
+from pathlib import Path
+
+from .auth import login
+from .core import (
+    BANDWIDTH,
+    DB,
+    DEFAULT_READAHEAD,
+    DEFAULT_TAGS,
+    INSERT_COST,
+    METRICS,
+    ORDER_POLICIES,
+    YOUTUBE_DAILY_QUOTA,
+    Checkpoints,
+    FitWindow,
+    JobQueue,
+    JsonLines,
+    LibraryIndex,
+    MiB,
+    Quota,
+    Scheduler,
+    Verifier,
+    created,
+    fetch_sizes,
+    file_size,
+    iter_videos,
+    migrate,
+    parse_schedule,
+    plan,
+    print_plan,
+    resolution,
+    select,
+    video_filters,
+)
+
+__all__ = [
+    "main",
+]
+
+
+def _selection(args):
+    """The API `filters` and the `where` predicate of the selection options"""
+    if args.album and args.favorites:
+        raise SystemExit("--favorites can't be combined with --album")
+    predicates = []
+    if args.album:
+        # the API can't filter the dates of an album
+        filters = {}
+        if args.since or args.until:
+            predicates.append(created(args.since, args.until))
+    else:
+        filters = video_filters(args.since, args.until, args.favorites)
+    if args.min_resolution or args.max_resolution:
+        predicates.append(resolution(args.min_resolution, args.max_resolution))
+    if args.min_size or args.max_size:
+        predicates.append(
+            file_size(
+                args.min_size and args.min_size * MiB,
+                args.max_size and args.max_size * MiB,
+            )
+        )
+    where = None
+    for predicate in predicates:
+        where = predicate if where is None else where & predicate
+    return filters, where
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m google_photos_to_youtube",
+        description="Migrate videos from Google Photos to YouTube",
+    )
+    parser.add_argument(
+        "--account",
+        default="default",
+        help="name of the saved credentials to use, to switch between accounts",
+    )
+    library = argparse.ArgumentParser(add_help=False)
+    library.add_argument(
+        "--index",
+        default="library.sqlite",
+        help="local index of the library, only new videos are listed on each run",
+    )
+    library.add_argument(
+        "--full-sync", action="store_true", help="list the whole library again"
+    )
+    # options shared by the commands that upload
+    transfer = argparse.ArgumentParser(add_help=False, parents=[library])
+    transfer.add_argument("--workers", type=int, default=4, help="concurrent transfers")
+    transfer.add_argument(
+        "--privacy", choices=["private", "unlisted", "public"], default="private"
+    )
+    transfer.add_argument("--tags", default=",".join(DEFAULT_TAGS))
+    transfer.add_argument(
+        "--readahead",
+        type=int,
+        default=DEFAULT_READAHEAD // MiB,
+        help="MiB of each download buffered ahead of the upload (0 disables it)",
+    )
+    transfer.add_argument(
+        "--chunk-size", type=float, default=1, help="initial upload chunk size in MiB"
+    )
+    transfer.add_argument(
+        "--fixed-chunks",
+        action="store_true",
+        help="don't adapt the chunk size to the measured throughput",
+    )
+    transfer.add_argument(
+        "--keep-duplicates",
+        action="store_true",
+        help="upload videos that look like a copy of one already migrated",
+    )
+    transfer.add_argument(
+        "--checkpoints",
+        default="checkpoints.json",
+        help="file where the state of unfinished uploads is kept",
+    )
+    transfer.add_argument(
+        "--order",
+        choices=list(ORDER_POLICIES),
+        default="api",
+        help="order of the transfers: as listed, by size, by creation time, or the "
+        "ones that fit in the window first",
+    )
+    transfer.add_argument(
+        "--window", type=float, help="hours available for the transfers, for --order fit"
+    )
+    transfer.add_argument(
+        "--bandwidth", type=float, help="expected upload MiB/s, for --order fit"
+    )
+    transfer.add_argument(
+        "--max-download", type=float, help="MiB/s shared by all the downloads, unlimited by default"
+    )
+    transfer.add_argument(
+        "--max-upload", type=float, help="MiB/s shared by all the uploads, unlimited by default"
+    )
+    transfer.add_argument(
+        "--limits",
+        help='download/upload MiB/s by local time, e.g. "09:00=4/1,19:00=-/-" ("-" is unlimited)',
+    )
+    transfer.add_argument(
+        "--metrics", help="append the events of each transfer to this file as json lines"
+    )
+    transfer.add_argument(
+        "--prometheus", help="write a snapshot of the totals in Prometheus text format"
+    )
+    transfer.add_argument(
+        "--verify",
+        action="store_true",
+        help="check that YouTube processes the uploads, the failed ones are migrated again",
+    )
+
+    # options to migrate only some of the videos
+    selection = transfer.add_argument_group("selection")
+    selection.add_argument(
+        "--since", type=datetime.date.fromisoformat, help="created on this date (YYYY-MM-DD) or later"
+    )
+    selection.add_argument(
+        "--until", type=datetime.date.fromisoformat, help="created on this date (YYYY-MM-DD) or before"
+    )
+    selection.add_argument("--album", help="id of the album to migrate")
+    selection.add_argument("--favorites", action="store_true", help="only the favorites")
+    selection.add_argument(
+        "--min-resolution", type=int, help="shorter side in pixels, e.g. 1080"
+    )
+    selection.add_argument("--max-resolution", type=int)
+    selection.add_argument("--min-size", type=float, help="MiB, each size is asked with a HEAD")
+    selection.add_argument("--max-size", type=float, help="MiB, each size is asked with a HEAD")
+
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_cmd = commands.add_parser(
+        "migrate", parents=[transfer], help="upload every video not migrated yet"
+    )
+    migrate_cmd.add_argument("--limit", type=int, help="stop after this many videos")
+    schedule_cmd = commands.add_parser(
+        "schedule",
+        parents=[transfer],
+        help="queue the videos not migrated yet and upload them within the daily quota",
+    )
+    schedule_cmd.add_argument(
+        "--jobs", default="jobs.json", help="file where the queue of pending videos is kept"
+    )
+    schedule_cmd.add_argument(
+        "--priority", type=int, default=0, help="priority of the newly queued videos"
+    )
+    schedule_cmd.add_argument(
+        "--quota", default="quota.json", help="file where the quota spent is counted"
+    )
+    schedule_cmd.add_argument(
+        "--daily-quota",
+        type=int,
+        default=YOUTUBE_DAILY_QUOTA,
+        help="units of YouTube Data API quota per day of the project",
+    )
+    schedule_cmd.add_argument(
+        "--once", action="store_true", help="stop when the quota runs out instead of waiting"
+    )
+    plan_cmd = commands.add_parser(
+        "plan",
+        parents=[library],
+        help="size the videos not migrated yet and estimate the time and quota needed",
+    )
+    plan_cmd.add_argument(
+        "--workers", type=int, default=16, help="concurrent requests to find out sizes"
+    )
+    plan_cmd.add_argument("--bandwidth", type=float, help="expected upload MiB/s")
+    plan_cmd.add_argument(
+        "--daily-quota",
+        type=int,
+        default=YOUTUBE_DAILY_QUOTA,
+        help="units of YouTube Data API quota per day of the project",
+    )
+    plan_cmd.add_argument("--json", action="store_true", help="print the report as json")
+    verify_cmd = commands.add_parser(
+        "verify",
+        help="wait until YouTube processes the migrated videos, and forget the failed ones",
+    )
+    verify_cmd.add_argument("--jobs", help="queue the failed videos again in this file")
+    verify_cmd.add_argument(
+        "--interval", type=float, default=30, help="seconds between checks, doubled while nothing changes"
+    )
+    verify_cmd.add_argument(
+        "--quota", default="quota.json", help="file where the quota spent is counted"
+    )
+    verify_cmd.add_argument(
+        "--daily-quota",
+        type=int,
+        default=YOUTUBE_DAILY_QUOTA,
+        help="units of YouTube Data API quota per day of the project",
+    )
+    args = parser.parse_args(argv)
+    if args.command in ("migrate", "schedule"):
+        try:
+            schedule = parse_schedule(args.limits) if args.limits else None
+        except ValueError as e:
+            parser.error(f"--limits: {e}")
+        for limit in (args.max_download, args.max_upload):
+            if limit is not None and limit <= 0:
+                # a fixed pause would never end, only a schedule can pause
+                parser.error("--max-download and --max-upload must be positive")
+
+    session = login("photos", args.account)
+    if args.command == "verify":
+        youtube = login("youtube", args.account)
+        verifier = Verifier(
+            session,
+            youtube,
+            queue=JobQueue(args.jobs) if args.jobs else None,
+            quota=Quota(
+                args.quota, daily=args.daily_quota, project=youtube._http.credentials.client_id
+            ),
+            interval=args.interval,
+        )
+        counts = verifier.run()
+        print(f"{counts['verified']} verified, {counts['failed']} failed, {counts['missing']} missing")
+        return 1 if counts["failed"] else 0
+
+    index = LibraryIndex(args.index)
+    if args.full_sync:
+        index.sync(session, full=True)
+    if args.command == "plan":
+        print(f"🔎 {index.sync(session)} new videos indexed, {len(index)} in total")
+        report = plan(
+            session,
+            index,
+            bandwidth=args.bandwidth * MiB if args.bandwidth else None,
+            workers=args.workers,
+            daily_quota=args.daily_quota,
+        )
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_plan(report)
+        return 0
+
+    youtube = login("youtube", args.account)
+    if args.limits:
+        BANDWIDTH.schedule = schedule
+    else:
+        BANDWIDTH.set(
+            args.max_download * MiB if args.max_download else None,
+            args.max_upload * MiB if args.max_upload else None,
+        )
+    if args.metrics:
+        METRICS.subscribe(JsonLines(args.metrics))
+    tags = [t.strip() for t in args.tags.split(",") if t.strip()]
+    checkpoints = Checkpoints(args.checkpoints)
+    options = dict(
+        readahead=args.readahead * MiB,
+        chunksize=int(args.chunk_size * MiB),
+        adaptive=not args.fixed_chunks,
+        dedupe=not args.keep_duplicates,
+    )
+    order = None
+    if args.order == "fit":
+        # in the scheduler only the uploads the daily quota allows fit
+        count = args.daily_quota // INSERT_COST if args.command == "schedule" else None
+        order = FitWindow(
+            count,
+            seconds=args.window * 3600 if args.window else None,
+            bandwidth=args.bandwidth * MiB if args.bandwidth else None,
+        )
+    elif args.order != "api":
+        order = ORDER_POLICIES[args.order]()
+    filters, where = _selection(args)
+    selected = bool(filters or args.album)
+    if args.command == "migrate":
+        results = migrate(
+            session,
+            youtube,
+            workers=args.workers,
+            privacy_status=args.privacy,
+            tags=tags,
+            limit=args.limit,
+            checkpoints=checkpoints,
+            index=index,
+            order=order,
+            filters=filters,
+            album_id=args.album,
+            where=where,
+            **options,
+        )
+        if args.verify:
+            Verifier(session, youtube).run()
+    elif args.command == "schedule":
+        # the verifier queues the failed uploads again with the metadata of their job
+        jobs = JobQueue(args.jobs, keep_done=args.verify)
+        if selected:
+            videos = iter_videos(session, filters=filters, album_id=args.album)
+        else:
+            print(f"🔎 {index.sync(session)} new videos indexed, {len(index)} in total")
+            videos = index
+        db = DB(session)
+        new = (v for v in videos if v["productUrl"] not in db and v["id"] not in jobs)
+        if where is not None:
+            # only the new ones are sized, if `where` needs it
+            new = select(session, new, where, index=index)
+        new = list(new)
+        if order is not None and order.needs_sizes:
+            fetch_sizes(session, new, index=index)
+        added = jobs.extend(
+            new,
+            priority=args.priority,
+            privacy_status=args.privacy,
+            tags=tags,
+        )
+        print(f"📋 {added} videos queued, {len(jobs)} pending")
+        quota = Quota(
+            args.quota, daily=args.daily_quota, project=youtube._http.credentials.client_id
+        )
+        scheduler = Scheduler(
+            session,
+            youtube,
+            jobs,
+            quota,
+            workers=args.workers,
+            checkpoints=checkpoints,
+            order=order,
+            **options,
+        )
+        if args.verify:
+            Verifier(session, youtube, queue=jobs, quota=quota).start()
+        results = scheduler.run(forever=not args.once)
+    failed = [key for key, value in results.items() if isinstance(value, Exception)]
+    print(f"{len(results) - len(failed)} migrated, {len(failed)} failed")
+    if args.prometheus:
+        Path(args.prometheus).write_text(METRICS.prometheus())
+    return 1 if failed else 0
@@ -0,0 +1,3289 @@
+"""
+The transfer core: the DB of migrated videos, the listing and download of the
+Google Photos videos, the resumable uploads to YouTube and the migration engines
+built on them. It imports neither the notebook widgets nor the OAuth flow, so
+headless workers start fast.
+"""
+import base64
+import bisect
+import collections.abc
+import datetime
+import functools
+import hashlib
+import http.client as httplib
+import itertools
+import json
+import os
+import queue
+import random
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+import zoneinfo
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import googleapiclient.errors
+import googleapiclient.http
+import httplib2
+import requests
+
+__all__ = [
+    "create_db_image",
+    "PHOTO_URL",
+    "YOUTUBE_URL",
+    "DESCRIPTION_LIMIT",
+    "encode_shard",
+    "decode_shard",
+    "shard_version",
+    "Mirror",
+    "DB",
+    "MAX_PAGE_SIZE",
+    "video_filters",
+    "get_videos",
+    "get_stream",
+    "get_media_item",
+    "stream_offset",
+    "stream_size",
+    "get_size",
+    "MiB",
+    "DEFAULT_CHUNK_SIZE",
+    "DEFAULT_READAHEAD",
+    "CHUNK_GRANULARITY",
+    "AdaptiveChunkSize",
+    "upload_stream",
+    "RETRIABLE_EXCEPTIONS",
+    "RETRIABLE_STATUS_CODES",
+    "http_status",
+    "Retry",
+    "LATENCY_BUCKETS",
+    "Histogram",
+    "Metrics",
+    "METRICS",
+    "JsonLines",
+    "TransferMetrics",
+    "TokenBucket",
+    "parse_schedule",
+    "Bandwidth",
+    "BANDWIDTH",
+    "MediaStreamUpload",
+    "DEFAULT_TAGS",
+    "default_title",
+    "default_description",
+    "fingerprint",
+    "prefetched",
+    "iter_pages",
+    "iter_videos",
+    "Where",
+    "created",
+    "resolution",
+    "frame_rate",
+    "select",
+    "file_size",
+    "get_media_items",
+    "LibraryIndex",
+    "fetch_sizes",
+    "video_size",
+    "OrderPolicy",
+    "SmallestFirst",
+    "LargestFirst",
+    "OldestFirst",
+    "FitWindow",
+    "ORDER_POLICIES",
+    "POOL_SIZE",
+    "discovery_document",
+    "youtube_client",
+    "size_pool",
+    "worker_youtube",
+    "Checkpoints",
+    "migrate_video",
+    "migrate",
+    "YOUTUBE_DAILY_QUOTA",
+    "INSERT_COST",
+    "LIST_COST",
+    "QUOTA_REASONS",
+    "error_reason",
+    "Quota",
+    "JobQueue",
+    "Scheduler",
+    "processing_status",
+    "Verifier",
+    "SIZE_BUCKETS",
+    "plan",
+    "print_plan",
+    "PACIFIC",
+]
+
+
+def create_db_image(session, album_id, description="{}"):
+    data = Path("db_image.webp").read_bytes()
+    result = session.post(
+        "https://photoslibrary.googleapis.com/v1/uploads",
+        data,
+        headers={
+            "Content-type": "application/octet-stream",
+            "X-Goog-Upload-Content-Type": "image/webp",
+            "X-Goog-Upload-Protocol": "raw",
+        },
+    )
+    token = result.content.decode()
+
+    payload = {
+        "newMediaItems": [
+            {"description": description, "simpleMediaItem": {"uploadToken": token}}
+        ],
+    }
+    if album_id:
+        payload["albumId"] = album_id
+
+    response = session.post(
+        "https://photoslibrary.googleapis.com/v1/mediaItems:batchCreate", json=payload
+    )
+
+    return response.json()["newMediaItemResults"][0]["mediaItem"]
+
+
+PHOTO_URL = "https://photos.google.com/lr/photo/"
+YOUTUBE_URL = "https://youtu.be/"
+
+# max length of the description of a media item
+DESCRIPTION_LIMIT = 1000
+
+
+def _shorten(url, prefix):
+    return url[len(prefix) :] if url.startswith(prefix) else url
+
+
+def _expand(value, prefix):
+    return value if "://" in value else prefix + value
+
+
+def encode_shard(entries):
+    """Compact a {gphoto url: youtube url} mapping to fit in a description"""
+    short = {_shorten(k, PHOTO_URL): _shorten(v, YOUTUBE_URL) for k, v in entries.items()}
+    raw = json.dumps(short, separators=(",", ":")).encode()
+    return "z1:" + base64.b64encode(zlib.compress(raw, 9)).decode()
+
+
+def decode_shard(description):
+    if description.startswith("z1:"):
+        short = json.loads(zlib.decompress(base64.b64decode(description[3:])))
+        return {_expand(k, PHOTO_URL): _expand(v, YOUTUBE_URL) for k, v in short.items()}
+    # the original format, a pretty printed json of full urls
+    return json.loads(description or "{}")
+
+
+def shard_version(description):
+    return f"{zlib.crc32(description.encode()):08x}"
+
+
+class Mirror:
+    """
+    Local SQLite copy of the DB.
+
+    Entries are keyed by Google Photos id, with indexes on the product url and the
+    YouTube id, so "is this migrated?" is a local indexed lookup. Each shard keeps
+    the version (a checksum of its description) last seen, so a sync only decodes
+    the shards that changed remotely.
+
+    The content hash and the `fingerprint` of the migrated videos are only kept
+    here (there's no room for them in the shards), to link duplicates, like the
+    processing status found by `Verifier`.
+    """
+
+    def __init__(self, path="db_mirror.sqlite"):
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                photo_id TEXT PRIMARY KEY,
+                product_url TEXT NOT NULL,
+                youtube_id TEXT NOT NULL,
+                shard INTEGER NOT NULL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS entries_product_url ON entries (product_url);
+            CREATE INDEX IF NOT EXISTS entries_youtube_id ON entries (youtube_id);
+            CREATE INDEX IF NOT EXISTS entries_shard ON entries (shard);
+            CREATE TABLE IF NOT EXISTS shards (
+                position INTEGER PRIMARY KEY,
+                item_id TEXT,
+                version TEXT
+            );
+            CREATE TABLE IF NOT EXISTS contents (
+                product_url TEXT PRIMARY KEY,
+                content_hash TEXT,
+                fingerprint TEXT
+            );
+            CREATE INDEX IF NOT EXISTS contents_hash ON contents (content_hash);
+            CREATE INDEX IF NOT EXISTS contents_fingerprint ON contents (fingerprint);
+            CREATE TABLE IF NOT EXISTS verifications (
+                youtube_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                reason TEXT,
+                checked_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS requeues (
+                product_url TEXT PRIMARY KEY,
+                count INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+
+    def _query(self, sql, *params):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def get(self, product_url):
+        rows = self._query(
+            "SELECT youtube_id FROM entries WHERE product_url = ?", product_url
+        )
+        return _expand(rows[0][0], YOUTUBE_URL) if rows else None
+
+    def find(self, youtube_url):
+        """Return the product url migrated to `youtube_url`, if any"""
+        rows = self._query(
+            "SELECT product_url FROM entries WHERE youtube_id = ?",
+            _shorten(youtube_url, YOUTUBE_URL),
+        )
+        return rows[0][0] if rows else None
+
+    def shard_of(self, product_url):
+        rows = self._query("SELECT shard FROM entries WHERE product_url = ?", product_url)
+        return rows[0][0] if rows else None
+
+    def __len__(self):
+        return self._query("SELECT count(*) FROM entries")[0][0]
+
+    def keys(self):
+        return [row[0] for row in self._query("SELECT product_url FROM entries")]
+
+    def put(self, product_url, youtube_url, shard):
+        self._query(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            _shorten(product_url, PHOTO_URL),
+            product_url,
+            _shorten(youtube_url, YOUTUBE_URL),
+            shard,
+        )
+
+    def delete(self, product_url):
+        self._query("DELETE FROM entries WHERE product_url = ?", product_url)
+
+    def shard_entries(self, position):
+        rows = self._query(
+            "SELECT product_url, youtube_id FROM entries WHERE shard = ?", position
+        )
+        return {key: _expand(value, YOUTUBE_URL) for key, value in rows}
+
+    def set_content(self, product_url, content_hash=None, fingerprint=None):
+        self._query(
+            "INSERT OR REPLACE INTO contents VALUES (?, ?, ?)",
+            product_url,
+            content_hash,
+            fingerprint,
+        )
+
+    def find_content(self, content_hash=None, fingerprint=None):
+        """Return the (product url, youtube url) of a migrated video with the same content"""
+        column, value = ("content_hash", content_hash) if content_hash else ("fingerprint", fingerprint)
+        rows = self._query(
+            "SELECT product_url, youtube_id FROM contents JOIN entries USING (product_url) "
+            f"WHERE {column} = ? LIMIT 1",
+            value,
+        )
+        return (rows[0][0], _expand(rows[0][1], YOUTUBE_URL)) if rows else None
+
+    def set_status(self, youtube_url, status, reason=None):
+        self._query(
+            "INSERT OR REPLACE INTO verifications VALUES (?, ?, ?, ?)",
+            _shorten(youtube_url, YOUTUBE_URL),
+            status,
+            reason,
+            time.time(),
+        )
+
+    def status(self, product_url):
+        rows = self._query(
+            "SELECT status, reason FROM entries JOIN verifications USING (youtube_id) "
+            "WHERE product_url = ?",
+            product_url,
+        )
+        return rows[0] if rows else None
+
+    def requeue(self, product_url):
+        """Count another upload of `product_url` after a failure, return how many there were"""
+        with self.lock:
+            self._query(
+                "INSERT INTO requeues VALUES (?, 1) "
+                "ON CONFLICT (product_url) DO UPDATE SET count = count + 1",
+                product_url,
+            )
+            return self._query("SELECT count FROM requeues WHERE product_url = ?", product_url)[0][0]
+
+    def unverified(self):
+        """List the (product url, youtube url) of the entries not verified nor failed"""
+        rows = self._query(
+            "SELECT product_url, youtube_id FROM entries "
+            "LEFT JOIN verifications USING (youtube_id) "
+            "WHERE status IS NULL OR status = 'processing'"
+        )
+        return [(key, _expand(value, YOUTUBE_URL)) for key, value in rows]
+
+    def shards(self):
+        """List the (item id, version) of each shard, by position"""
+        return [
+            (item_id, version)
+            for item_id, version in self._query(
+                "SELECT item_id, version FROM shards ORDER BY position"
+            )
+        ]
+
+    def set_shard(self, position, item_id, version):
+        self._query("INSERT OR REPLACE INTO shards VALUES (?, ?, ?)", position, item_id, version)
+
+    def replace_shard(self, position, item_id, version, entries):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM entries WHERE shard = ?", (position,))
+            for key, value in entries.items():
+                self.put(key, value, position)
+            self.set_shard(position, item_id, version)
+            self.conn.execute("COMMIT")
+
+    def truncate(self, count):
+        """Forget the shards from position `count` on"""
+        self._query("DELETE FROM entries WHERE shard >= ?", count)
+        self._query("DELETE FROM shards WHERE position >= ?", count)
+
+    def get_meta(self, key, default=None):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", key)
+        return rows[0][0] if rows else default
+
+    def set_meta(self, key, value):
+        self._query("INSERT OR REPLACE INTO meta VALUES (?, ?)", key, str(value))
+
+
+class DB(collections.abc.MutableMapping):
+    """
+    A Borg (shared state) dict-like object to permanently store already migrated videos.
+    It maps gphoto url to youtube urls.
+
+    It's stored in the description of the items of the album "migrated-to-youtube"
+    that's created if needed. As a description is limited to 1000 characters, the
+    mapping is split in shards, one per item, holding the compressed json of the
+    entries without the redundant url prefixes (see `encode_shard`). A key goes to
+    the shard picked by its hash, or the next one with room, and new shards are
+    uploaded when all are full. Only the modified shards are committed.
+
+    This is a workaround to the limitations of the Goole Photos API
+    that doesn't allow to delete or update the description of items that weren't
+    created by the app, nor add them to a custom album.
+
+    Lookups are served by a local `Mirror`. On startup the album is listed (one
+    request per 100 shards) to see the entries other machines committed, but only
+    the shards whose version changed are decoded.
+
+    By default every change is committed right away. In write-behind mode
+    (see `write_behind()`) changes are appended to a local journal and a background
+    thread commits them together, every `interval` seconds or `every` changes.
+    The journal is replayed on the next start if the process dies before a flush.
+    """
+    _shared_state = {}
+
+    def __init__(self, session, journal="db_journal.jsonl", mirror="db_mirror.sqlite"):
+        self.__dict__ = self._shared_state
+        if not self._shared_state:
+            self.session = session
+            self.lock = threading.RLock()
+            self.flush_lock = threading.Lock()
+            self.mirror = Mirror(mirror)
+            # each shard is {"item": media item or None if not created yet,
+            # "entries": {...} or None if not loaded from the mirror yet}
+            self.shards = []
+            self.dirty = set()  # indexes of the modified shards
+            self.full = set()  # indexes of the shards that couldn't take a new entry
+            self.changes = 0
+            self.flusher = None
+            self.writers = 0  # nested `write_behind()` calls, the last one to stop flushes
+            self._sync()
+            self.journal_path = Path(journal)
+            self._replay_journal()
+            self.journal = self.journal_path.open("ab")
+
+    def _sync(self):
+        """Update the mirror with the shards that changed remotely"""
+        self.album_id, items = self._get_or_create_db()
+        known = self.mirror.shards()
+        legacy = {}
+        for position, item in enumerate(items):
+            description = item.get("description", "")
+            version = shard_version(description)
+            self.shards.append({"item": item, "entries": None})
+            if position < len(known) and known[position] == (item["id"], version):
+                continue
+            if description.startswith("z1:"):
+                self.mirror.replace_shard(position, item["id"], version, decode_shard(description))
+            else:
+                # the original format is converted with the first commit
+                self.mirror.replace_shard(position, item["id"], version, {})
+                legacy.update(decode_shard(description))
+        self.mirror.truncate(len(items))
+        for key, value in legacy.items():
+            self._place(key, value)
+        self.mirror.set_meta("album_id", self.album_id)
+
+    def __getitem__(self, key):
+        value = self.mirror.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        # workers of the migration engine finish uploads concurrently
+        with self.lock:
+            self._place(key, value)
+            self._changed(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self._remove(key)
+            self._changed(key, None)
+
+    def __len__(self):
+        return len(self.mirror)
+
+    def __iter__(self):
+        yield from self.mirror.keys()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_write_behind()
+
+    def find(self, youtube_url):
+        """Return the gphoto url migrated to `youtube_url`, if any"""
+        return self.mirror.find(youtube_url)
+
+    def set_content(self, key, content_hash=None, fingerprint=None):
+        """Keep the content hash and the `fingerprint` of a migrated video"""
+        self.mirror.set_content(key, content_hash, fingerprint)
+
+    def find_duplicate(self, content_hash=None, fingerprint=None):
+        """Return the (gphoto url, youtube url) of a migrated video with the same content"""
+        return self.mirror.find_content(content_hash, fingerprint)
+
+    def status(self, key):
+        """The (status, reason) YouTube gave to the video migrated from `key`, see `Verifier`"""
+        return self.mirror.status(key)
+
+    def set_status(self, youtube_url, status, reason=None):
+        self.mirror.set_status(youtube_url, status, reason)
+
+    def unverified(self):
+        """List the (gphoto url, youtube url) of the videos YouTube didn't process yet"""
+        return self.mirror.unverified()
+
+    def requeue(self, key):
+        """Count another upload of `key` after YouTube failed it, return how many there were"""
+        return self.mirror.requeue(key)
+
+    def _entries(self, index):
+        shard = self.shards[index]
+        if shard["entries"] is None:
+            shard["entries"] = self.mirror.shard_entries(index)
+        return shard["entries"]
+
+    def _remove(self, key):
+        index = self.mirror.shard_of(key)
+        if index is None:
+            raise KeyError(key)
+        del self._entries(index)[key]
+        self.mirror.delete(key)
+        self.dirty.add(index)
+        self.full.discard(index)
+
+    def _place(self, key, value):
+        """Put the entry in its shard, moving it if it doesn't fit anymore"""
+        index = self.mirror.shard_of(key)
+        if index is not None:
+            entries = self._entries(index)
+            if len(encode_shard({**entries, key: value})) <= DESCRIPTION_LIMIT:
+                entries[key] = value
+                self.mirror.put(key, value, index)
+                self.dirty.add(index)
+                return
+            self._remove(key)
+        count = len(self.shards)
+        start = zlib.crc32(key.encode()) % count if count else 0
+        for index in [(start + i) % count for i in range(count)] + [count]:
+            if index in self.full:
+                continue
+            if index == count:
+                # every shard is full, a new one is uploaded with the next commit
+                self.shards.append({"item": None, "entries": {}})
+                self.mirror.set_shard(index, None, None)
+            entries = self._entries(index)
+            if len(encode_shard({**entries, key: value})) <= DESCRIPTION_LIMIT:
+                break
+            self.full.add(index)
+        entries[key] = value
+        self.mirror.put(key, value, index)
+        self.dirty.add(index)
+
+    def _changed(self, key, value):
+        if self.flusher is None:
+            self._commit()
+            return
+        self.journal.write(json.dumps({"key": key, "value": value}).encode() + b"\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.changes += 1
+        if self.changes >= self.flush_every:
+            self.flush_needed.set()
+
+    def _replay_journal(self):
+        """Commit what a previous process journaled but couldn't flush"""
+        if self.journal_path.exists():
+            for line in self.journal_path.read_text().splitlines():
+                change = json.loads(line)
+                if change["value"] is None:
+                    if change["key"] in self:
+                        self._remove(change["key"])
+                else:
+                    self._place(change["key"], change["value"])
+        if self.dirty:
+            self._commit()
+        if self.journal_path.exists():
+            self.journal_path.unlink()
+
+    def write_behind(self, interval=30, every=50):
+        """
+        Start committing in the background. Use it as a context manager, or call
+        `stop_write_behind()` at shutdown, to flush the remaining changes.
+        As the state is shared, each call must be paired with a stop, and only the
+        last stop ends the background commits.
+        """
+        with self.lock:
+            self.writers += 1
+            if self.flusher is None:
+                self.flush_interval = interval
+                self.flush_every = every
+                self.flush_needed = threading.Event()
+                self.stopping = False
+                self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self.flusher.start()
+        return self
+
+    def stop_write_behind(self):
+        with self.lock:
+            if self.writers > 1:
+                self.writers -= 1
+                return
+            self.writers = 0
+            flusher = self.flusher
+        if flusher is not None:
+            self.stopping = True
+            self.flush_needed.set()
+            flusher.join()
+            self.flusher = None
+        self.flush()
+
+    def _flush_loop(self):
+        while not self.stopping:
+            self.flush_needed.wait(self.flush_interval)
+            self.flush_needed.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  DB flush failed, will retry: {e!r}")
+
+    def flush(self):
+        """Commit the pending changes of the write-behind mode"""
+        with self.flush_lock:
+            with self.lock:
+                if not self.dirty:
+                    return
+                dirty, snapshot = self._take_dirty()
+                self.changes = 0
+                journaled = self.journal.tell()
+            try:
+                self._write_shards(snapshot)
+            except Exception:
+                with self.lock:
+                    self.dirty |= dirty
+                raise
+            with self.lock:
+                # keep only what was journaled after the snapshot
+                with self.journal_path.open("rb") as f:
+                    f.seek(journaled)
+                    rest = f.read()
+                self.journal.close()
+                self.journal_path.write_bytes(rest)
+                self.journal = self.journal_path.open("ab")
+
+    def _write_shards(self, snapshot):
+        """Upload the new shards and patch the modified ones, concurrently"""
+
+        def write(index, item, description):
+            if item is None:
+                item = self.shards[index]["item"] = create_db_image(
+                    self.session, self.album_id, description
+                )
+            else:
+                response = self.session.patch(
+                    f"https://photoslibrary.googleapis.com/v1/mediaItems/{item['id']}?updateMask=description",
+                    json={"description": description},
+                )
+                response.raise_for_status()
+            self.mirror.set_shard(index, item["id"], shard_version(description))
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futures = [
+                pool.submit(write, index, item, description)
+                for index, (item, description) in snapshot.items()
+            ]
+        for future in futures:
+            future.result()
+
+    def _take_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        snapshot = {
+            index: (self.shards[index]["item"], encode_shard(self.shards[index]["entries"]))
+            for index in dirty
+        }
+        return dirty, snapshot
+
+    def _commit(self):
+        with self.lock:
+            dirty, snapshot = self._take_dirty()
+            try:
+                self._write_shards(snapshot)
+            except Exception:
+                self.dirty |= dirty
+                raise
+
+    def _get_or_create_db(self):
+        """
+        return the id of the album that holds our db and its items (the shards).
+        If the album doesn't exist, it's created.
+        """
+        result = self.session.get(
+            "https://photoslibrary.googleapis.com/v1/albums",
+            params={"excludeNonAppCreatedData": True},
+        )
+        for album in result.json().get("albums", []):
+            if album["title"] == "migrated-to-youtube":
+                items = []
+                query = {"albumId": album["id"], "pageSize": 100}
+                while True:
+                    result = self.session.post(
+                        "https://photoslibrary.googleapis.com/v1/mediaItems:search",
+                        json=query,
+                    ).json()
+                    items.extend(result.get("mediaItems", []))
+                    if not result.get("nextPageToken"):
+                        return album["id"], items
+                    query["pageToken"] = result["nextPageToken"]
+        else:
+            album = self.session.post(
+                "https://photoslibrary.googleapis.com/v1/albums",
+                json={"album": {"title": "migrated-to-youtube"}},
+            ).json()
+            return album["id"], []
+
+    def _repr_html_(self):
+        html = ["<table width=100%>"]
+        for key, value in self.items():
+            html.append("<tr><th>Google Photos</th><th>Youtube</th></tr>")
+            html.append("<tr>")
+            html.append(f"<td><a href='{key}'>{key}</a></td>")
+            html.append(f"<td><a href='{value}'>{value}</a></td>")
+            html.append("</tr>")
+        html.append("</table>")
+        return ''.join(html)
+
+
+# the largest pageSize accepted by mediaItems:search
+MAX_PAGE_SIZE = 100
+
+
+def video_filters(start=None, end=None, favorites=False):
+    """
+    Filters of mediaItems:search for the videos created from the date `start`
+    to `end` (both included), and only the favorites if `favorites`
+    """
+    filters = {}
+    if start or end:
+        start = start or datetime.date(1900, 1, 1)
+        end = end or datetime.date.today()
+        filters["dateFilter"] = {"ranges": [{"startDate": _date(start), "endDate": _date(end)}]}
+    if favorites:
+        filters["featureFilter"] = {"includedFeatures": ["FAVORITES"]}
+    return filters
+
+
+def _search_query(token, page_size, filters, album_id=None):
+    q = {"pageSize": page_size}
+    if album_id:
+        # the API doesn't take filters (not even the media type) with an album
+        if filters:
+            raise ValueError("filters can't be combined with an album, see `created`")
+        q["albumId"] = album_id
+    else:
+        q["filters"] = {"mediaTypeFilter": {"mediaTypes": ["VIDEO"]}, **(filters or {})}
+    if token:
+        q["pageToken"] = token
+    return q
+
+
+def get_videos(session, token=None, page_size=MAX_PAGE_SIZE, filters=None, album_id=None):
+    """
+    A page of mediaItems:search: the videos of the library, narrowed down by
+    `filters` (see `video_filters`), or the items of the album `album_id`
+    """
+    q = _search_query(token, page_size, filters, album_id)
+    return session.post(
+        "https://photoslibrary.googleapis.com/v1/mediaItems:search", json=q
+    ).json()
+
+
+# the targets of the =dv redirects are signed urls, they are requested without
+# the Authorization header of the AuthorizedSession (like requests does on redirects)
+_direct = requests.Session()
+
+
+def get_stream(session, video, offset=0):
+    """
+    Open the download of `video` from `offset` on. Its size is in the headers
+    (see `stream_size`), there's no need of a previous HEAD.
+
+    The target of the =dv redirects is kept in the video, so reopening it
+    (e.g. with a Range after an error) skips the redirect chain.
+    """
+    headers = {"Range": f"bytes={offset}-"} if offset else None
+    resolved = video.get("_download_url")
+    if resolved:
+        stream = _direct.get(resolved, stream=True, headers=headers)
+        if stream.ok:
+            return stream
+        # expired, follow the redirects again
+        stream.close()
+    stream = session.get(f"{video['baseUrl']}=dv", stream=True, headers=headers)
+    stream.raise_for_status()
+    if stream.history:
+        video["_download_url"] = stream.url
+    return stream
+
+
+def get_media_item(session, item_id):
+    """Fetch a fresh copy of a media item (its baseUrl expires after 60 minutes)"""
+    response = session.get(f"https://photoslibrary.googleapis.com/v1/mediaItems/{item_id}")
+    response.raise_for_status()
+    return response.json()
+
+
+def _status(response):
+    # requests and aiohttp responses
+    return getattr(response, "status_code", None) or response.status
+
+
+def stream_offset(stream):
+    """Absolute position of the first byte of a (possibly ranged) download"""
+    content_range = stream.headers.get("Content-Range")
+    if _status(stream) == 206 and content_range:
+        # bytes <first>-<last>/<total>
+        return int(content_range.split()[1].split("-")[0])
+    return 0
+
+
+def stream_size(stream):
+    """Total size of the video, even if the download only covers part of it"""
+    content_range = stream.headers.get("Content-Range")
+    if _status(stream) == 206 and content_range:
+        return int(content_range.rsplit("/", 1)[1])
+    return int(stream.headers["Content-Length"])
+
+
+def get_size(session, video):
+    """Size of the video, for when it's needed without downloading it"""
+    response = session.head(f"{video['baseUrl']}=dv", allow_redirects=True)
+    # an expired baseUrl answers 403, with the length of the error page
+    response.raise_for_status()
+    return int(response.headers["Content-Length"])
+
+
+MiB = 1024 * 1024
+
+DEFAULT_CHUNK_SIZE = MiB
+
+# bytes of the download buffered ahead of the upload by the migration engine
+DEFAULT_READAHEAD = 8 * DEFAULT_CHUNK_SIZE
+
+# resumable upload chunks must be a multiple of this (but the last one)
+CHUNK_GRANULARITY = 256 * 1024
+
+
+class AdaptiveChunkSize:
+    """
+    Choose the chunk size of a resumable upload from the measured throughput.
+
+    Each chunk should take about `target` seconds: the size grows on fast links
+    (fewer round trips per GB) and shrinks on slow ones or after a failure (less
+    to send again). It changes at most 2x per chunk, in multiples of 256 KiB
+    between `minimum` and `maximum`.
+    """
+
+    def __init__(
+        self,
+        initial=DEFAULT_CHUNK_SIZE,
+        minimum=CHUNK_GRANULARITY,
+        maximum=64 * DEFAULT_CHUNK_SIZE,
+        target=4.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.size = self._clamp(initial)
+        # (chunk size, seconds, bytes per second) of each accepted chunk
+        self.history = []
+
+    def _clamp(self, size):
+        size = int(size) // CHUNK_GRANULARITY * CHUNK_GRANULARITY
+        return max(self.minimum, min(self.maximum, size))
+
+    def record(self, nbytes, seconds):
+        throughput = nbytes / max(seconds, 1e-3)
+        self.history.append((self.size, seconds, throughput))
+        ideal = throughput * self.target
+        self.size = self._clamp(min(max(ideal, self.size / 2), self.size * 2))
+
+    def failed(self):
+        self.size = self._clamp(self.size // 2)
+
+    def summary(self):
+        if not self.history:
+            return "no chunks"
+        sizes = [size for size, _, _ in self.history]
+        speed = sum(nbytes for nbytes, _, _ in self.history) / sum(
+            seconds for _, seconds, _ in self.history
+        )
+        return (
+            f"{len(sizes)} chunks of {min(sizes) / MiB:g}-{max(sizes) / MiB:g} MiB "
+            f"(last {sizes[-1] / MiB:g} MiB), {speed / MiB:.1f} MiB/s"
+        )
+
+
+def _video_body(title, description, privacy_status, tags):
+    return {
+        "snippet": {
+            "title": title,
+            "description": description,
+            "tags": list(tags),
+        },
+        "status": {
+            "privacyStatus": privacy_status,
+        },
+    }
+
+
+def upload_stream(
+    youtube,
+    stream,
+    title,
+    description="",
+    privacy_status="private",  # "unlisted", "public"
+    tags=(),
+    progress=None,
+    resumable_uri=None,
+    on_chunk=None,
+    retry=None,
+):
+    """
+    Upload `stream` (a download response or a MediaStreamUpload) to YouTube.
+
+    To continue an interrupted upload pass the `resumable_uri` of its session:
+    YouTube is asked for the committed offset before sending any byte.
+    `on_chunk(resumable_uri, offset)` is called after each accepted chunk.
+    Failed chunks are retried according to `retry` (a `Retry` instance).
+    The transfer is measured in the `metrics` of the MediaStreamUpload.
+    """
+    body = _video_body(title, description, privacy_status, tags)
+    body_keys = ",".join(body.keys())
+
+    retry = retry or Retry()
+    if isinstance(stream, MediaStreamUpload):
+        media = stream
+    else:
+        media = MediaStreamUpload(stream, retry=retry)
+    request = youtube.videos().insert(part=body_keys, body=body, media_body=media)
+    if resumable_uri:
+        # in "error state" googleapiclient first queries the session for the
+        # committed range and continues from there
+        request.resumable_uri = resumable_uri
+        request._in_error_state = True
+
+    metrics = media.metrics
+    metrics.start(media.size())
+
+    def on_error(error):
+        metrics.on_retry("upload", error)
+        if request.resumable_uri:
+            request._in_error_state = True
+        if media.adaptive:
+            media.adaptive.failed()
+
+    def next_chunk():
+        sent = metrics.sent
+        producing = metrics.wait_seconds + metrics.buffer_seconds
+        started = time.monotonic()
+        try:
+            return request.next_chunk()
+        finally:
+            metrics.on_chunk(
+                time.monotonic() - started,
+                metrics.wait_seconds + metrics.buffer_seconds - producing,
+                metrics.sent - sent,
+                request.resumable_progress,
+            )
+
+    try:
+        while True:
+            committed = request.resumable_progress
+            started = time.monotonic()
+            status, response = retry.call(next_chunk, on_retry=on_error)
+            if status and media.adaptive:
+                media.adaptive.record(
+                    request.resumable_progress - committed, time.monotonic() - started
+                )
+            if status and on_chunk:
+                on_chunk(request.resumable_uri, request.resumable_progress)
+            if status and progress:
+                progress.value = request.resumable_progress
+            if response:
+                if progress:
+                    progress.value = progress.max
+                if media.adaptive:
+                    print(f"📦 {title}: {media.adaptive.summary()}")
+                url = f"https://youtu.be/{response['id']}"
+                metrics.finish(url)
+                return url
+    except Exception as e:
+        metrics.finish(error=e)
+        raise
+    finally:
+        media.close()
+
+
+RETRIABLE_EXCEPTIONS = [
+    socket.error,
+    IOError,
+    httplib2.HttpLib2Error,
+    httplib.NotConnected,
+    httplib.IncompleteRead,
+    httplib.ImproperConnectionState,
+    httplib.CannotSendRequest,
+    httplib.CannotSendHeader,
+    httplib.ResponseNotReady,
+    httplib.BadStatusLine,
+]
+
+# http errors are retried only with these status, anything else (quota, auth,
+# invalid metadata) won't get better by trying again
+RETRIABLE_STATUS_CODES = (500, 502, 503, 504)
+
+
+def http_status(error):
+    """Status code of a failed response from googleapiclient or requests, if any"""
+    if isinstance(error, googleapiclient.errors.HttpError):
+        return error.resp.status
+    response = getattr(error, "response", None)
+    if response is not None:
+        return getattr(response, "status_code", None)
+    # aiohttp.ClientResponseError
+    return getattr(error, "status", None)
+
+
+class Retry:
+    """
+    Retry budget of a single transfer, shared by its download and its upload.
+
+    Retriable failures are retried with jittered exponential backoff until
+    `max_retries` consecutive attempts fail or `budget` retries were spent in total.
+    """
+
+    def __init__(self, max_retries=8, budget=20, base=1.0, cap=60.0, sleep=time.sleep):
+        self.max_retries = max_retries
+        self.budget = budget
+        self.base = base
+        self.cap = cap
+        self.sleep = sleep
+        self.spent = 0
+
+    def is_retriable(self, error):
+        status = http_status(error)
+        if status is not None:
+            return status in RETRIABLE_STATUS_CODES
+        return isinstance(error, tuple(RETRIABLE_EXCEPTIONS))
+
+    def backoff(self, attempt):
+        # "full jitter", so concurrent workers hitting the same outage spread out
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+    def _retrying(self, error, attempt):
+        """Spend a retry on the `attempt`th failure and return its delay, or None to give up"""
+        if (
+            not self.is_retriable(error)
+            or attempt > self.max_retries
+            or self.spent >= self.budget
+        ):
+            return None
+        self.spent += 1
+        delay = self.backoff(attempt)
+        print(f"⚠️  {error!r}, retrying in {delay:.1f}s ({self.spent}/{self.budget})")
+        return delay
+
+    def call(self, func, *args, on_retry=None, **kwargs):
+        """Call `func` until it succeeds. `on_retry(error)` runs before each new attempt"""
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                attempt += 1
+                delay = self._retrying(error, attempt)
+                if delay is None:
+                    raise
+                if on_retry:
+                    on_retry(error)
+                self.sleep(delay)
+
+    async def acall(self, func, *args, on_retry=None, **kwargs):
+        """`call` for a coroutine function `func`, `on_retry` is awaited too"""
+        # only the asyncio engine awaits, the threaded workers don't pay for asyncio
+        import asyncio
+
+        attempt = 0
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as error:
+                attempt += 1
+                delay = self._retrying(error, attempt)
+                if delay is None:
+                    raise
+                if on_retry:
+                    await on_retry(error)
+                await asyncio.sleep(delay)
+
+
+# upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+class Histogram:
+    """Latency histogram with the cumulative buckets of a Prometheus histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def prometheus(self, name):
+        lines = [f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class Metrics:
+    """
+    Totals of every transfer, and the subscribers of their events.
+
+    Each event is a dict with at least "event", "transfer" and "time", and it's
+    passed to the callbacks registered with `subscribe` (e.g. a `JsonLines`).
+    `prometheus()` returns a snapshot of the totals in the Prometheus text format.
+    """
+
+    def __init__(self, prefix="google_photos_to_youtube_"):
+        self.prefix = prefix
+        self.counters = collections.Counter()
+        self.active = 0
+        self.histograms = {
+            "first_byte_seconds": Histogram(),
+            "chunk_latency_seconds": Histogram(),
+        }
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def emit(self, event, transfer=None, **fields):
+        record = {"event": event, "transfer": transfer, "time": time.time(), **fields}
+        with self._lock:
+            self._aggregate(record)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(record)
+            except Exception as e:
+                # a broken subscriber must not break the transfer
+                print(f"⚠️  metrics subscriber {callback!r} failed: {e!r}")
+
+    def _aggregate(self, record):
+        event = record["event"]
+        if event == "start":
+            self.active += 1
+        elif event == "connect":
+            self.counters["connections_total"] += 1
+            self.histograms["first_byte_seconds"].observe(record["seconds"])
+        elif event == "download":
+            self.counters["downloaded_bytes_total"] += record["bytes"]
+            self.counters["download_seconds_total"] += record["seconds"]
+        elif event == "chunk":
+            self.counters["uploaded_bytes_total"] += record["bytes"]
+            self.counters["upload_seconds_total"] += record["upload_seconds"]
+            self.counters["wait_seconds_total"] += record["wait_seconds"]
+            self.counters["buffer_seconds_total"] += record["buffer_seconds"]
+            self.histograms["chunk_latency_seconds"].observe(record["seconds"])
+        elif event == "retry":
+            self.counters[f'retries_total{{stage="{record["stage"]}"}}'] += 1
+        elif event == "finish":
+            self.active -= 1
+            self.counters["resent_bytes_total"] += record["bytes_resent"]
+            self.counters[f'transfers_total{{status="{record["status"]}"}}'] += 1
+
+    def prometheus(self):
+        """Snapshot of the totals in the Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                f"# TYPE {self.prefix}active_transfers gauge",
+                f"{self.prefix}active_transfers {self.active}",
+            ]
+            typed = set()
+            for name in sorted(self.counters):
+                base = name.split("{")[0]
+                if base not in typed:
+                    typed.add(base)
+                    lines.append(f"# TYPE {self.prefix}{base} counter")
+                lines.append(f"{self.prefix}{name} {self.counters[name]}")
+            for name, histogram in self.histograms.items():
+                lines.extend(histogram.prometheus(self.prefix + name))
+        return "\n".join(lines) + "\n"
+
+
+# events of every transfer go here unless they are given another `Metrics`
+METRICS = Metrics()
+
+
+class JsonLines:
+    """Metrics subscriber that appends each event to `path` as a json line"""
+
+    def __init__(self, path):
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self._file.write(json.dumps(event) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class TransferMetrics:
+    """
+    Measurements of a single transfer, reported as events to `hub`.
+
+    The time is split by where it goes, to tell what bounds a slow transfer:
+    `wait_seconds` is the upload blocked on the Photos download, `buffer_seconds`
+    is copying into the upload window and `upload_seconds` is the chunk requests
+    to YouTube besides producing their bytes. `download_seconds` is the time spent
+    reading the download (in the read-ahead thread, if any).
+    """
+
+    def __init__(self, name=None, hub=None):
+        self.name = name
+        self.hub = METRICS if hub is None else hub
+        self.started = time.monotonic()
+        self.size = None
+        self.first_byte = None  # seconds to the response of the first download
+        self.connections = 0
+        self.downloaded = 0
+        self.download_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.buffer_seconds = 0.0
+        self.upload_seconds = 0.0
+        self.sent = 0  # bytes handed to the upload, sent again ones included
+        self.resent = 0
+        self.chunks = []  # seconds of each chunk request
+        self.retries = collections.Counter()
+        self._sent_until = 0
+        self._reported = (0.0, 0.0)  # wait and buffer seconds already in a chunk event
+
+    def _emit(self, event, **fields):
+        self.hub.emit(event, self.name, **fields)
+
+    def start(self, size):
+        self.size = size
+        self._emit("start", size=size)
+
+    def on_connect(self, seconds, offset):
+        """A download from `offset` answered after `seconds`"""
+        if self.first_byte is None:
+            self.first_byte = seconds
+        self.connections += 1
+        self._emit("connect", seconds=seconds, offset=offset)
+
+    def on_download(self, nbytes, seconds):
+        self.downloaded += nbytes
+        self.download_seconds += seconds
+        self._emit("download", bytes=nbytes, seconds=seconds)
+
+    def on_buffer(self, begin, nbytes, seconds, waited):
+        """`getbytes` returned `nbytes` from `begin`, `waited` of its `seconds` on the download"""
+        self.wait_seconds += waited
+        self.buffer_seconds += seconds - waited
+        self.sent += nbytes
+        if begin < self._sent_until:
+            self.resent += min(self._sent_until, begin + nbytes) - begin
+        self._sent_until = max(self._sent_until, begin + nbytes)
+
+    def on_chunk(self, seconds, produced, sent, committed):
+        """
+        A chunk request took `seconds`, `produced` of them getting its bytes.
+        `sent` is the amount given to it and `committed` the offset YouTube has.
+        """
+        self.upload_seconds += seconds - produced
+        self.chunks.append(seconds)
+        # the events carry the increments, so the hub can add them up
+        wait, buffer = self._reported
+        self._reported = (self.wait_seconds, self.buffer_seconds)
+        self._emit(
+            "chunk",
+            bytes=sent,
+            committed=committed,
+            seconds=seconds,
+            upload_seconds=seconds - produced,
+            wait_seconds=self.wait_seconds - wait,
+            buffer_seconds=self.buffer_seconds - buffer,
+        )
+
+    def on_retry(self, stage, error):
+        self.retries[stage] += 1
+        self._emit("retry", stage=stage, error=repr(error))
+
+    def finish(self, url=None, error=None):
+        self._emit(
+            "finish",
+            status="failed" if error else "ok",
+            url=url,
+            error=repr(error) if error else None,
+            **self.summary(),
+        )
+
+    def summary(self):
+        stages = {
+            "download": self.wait_seconds,
+            "buffering": self.buffer_seconds,
+            "upload": self.upload_seconds,
+        }
+        return {
+            "size": self.size,
+            "seconds": round(time.monotonic() - self.started, 3),
+            "first_byte_seconds": self.first_byte,
+            "connections": self.connections,
+            "download_mib_s": round(self.downloaded / MiB / max(self.download_seconds, 1e-6), 2),
+            "upload_mib_s": round(self.sent / MiB / max(self.upload_seconds, 1e-6), 2),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "buffer_seconds": round(self.buffer_seconds, 3),
+            "upload_seconds": round(self.upload_seconds, 3),
+            "bytes_resent": self.resent,
+            "retries": dict(self.retries),
+            "chunk_latency_seconds": {
+                "p50": _percentile(self.chunks, 0.5),
+                "p90": _percentile(self.chunks, 0.9),
+                "max": max(self.chunks, default=None),
+            },
+            "bound_by": max(stages, key=stages.get),
+        }
+
+
+class TokenBucket:
+    """
+    Token bucket of `rate` bytes per second (None is unlimited, 0 pauses) shared
+    by many streams, with bursts of up to `burst` bytes (a second of `rate` by default).
+
+    Bytes are taken in pieces of up to `quantum`, served in arrival order, so the
+    active streams share the rate evenly and a big transfer can't starve the rest.
+    `refresh` is called while waiting, to update the rate (see `Bandwidth`).
+    """
+
+    def __init__(self, rate=None, burst=None, quantum=64 * 1024, refresh=None):
+        self.rate = rate
+        self.burst = burst
+        self.quantum = quantum
+        self.refresh = refresh
+        self._tokens = 0.0  # negative while a piece taken on credit is paid back
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self._tickets = itertools.count()
+        self._serving = 0
+
+    def set_rate(self, rate):
+        with self._condition:
+            self._refill()
+            self.rate = rate
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            capacity = self.burst or self.rate
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, capacity)
+        self._updated = now
+
+    def take(self, nbytes):
+        """Block until `nbytes` fit in the rate"""
+        while nbytes > 0 and self.rate is not None:
+            piece = min(nbytes, self.quantum)
+            self._take(piece)
+            nbytes -= piece
+
+    def _take(self, nbytes):
+        with self._condition:
+            ticket = next(self._tickets)
+            while ticket != self._serving:
+                self._condition.wait()
+        try:
+            while True:
+                if self.refresh is not None:
+                    self.refresh()
+                with self._condition:
+                    self._refill()
+                    if self.rate is None:
+                        return
+                    if self.rate == 0:
+                        # paused, until the rate changes
+                        delay = 0.1
+                    elif self._tokens >= 0:
+                        self._tokens -= nbytes
+                        return
+                    else:
+                        delay = -self._tokens / self.rate
+                # in short naps, the rate may change meanwhile
+                time.sleep(min(delay, 0.1))
+        finally:
+            with self._condition:
+                self._serving += 1
+                self._condition.notify_all()
+
+
+def parse_schedule(text):
+    """
+    Parse a schedule of limits for `Bandwidth` like "09:00=2/0.5,19:00=-/-": from
+    each local time on, the download/upload limits in MiB/s, "-" is unlimited
+    and 0 pauses the transfers
+    """
+    schedule = []
+    for entry in text.split(","):
+        start, limits = entry.strip().split("=")
+        hours, minutes = start.split(":")
+        rates = [
+            None if limit.strip() == "-" else float(limit) * MiB
+            for limit in limits.split("/")
+        ]
+        if any(rate is not None and rate < 0 for rate in rates):
+            raise ValueError(f"negative limit in {entry!r}")
+        schedule.append((f"{int(hours):02d}:{int(minutes):02d}", *rates))
+    return sorted(schedule)
+
+
+class Bandwidth:
+    """
+    Download and upload limits shared by all the transfers, in bytes per second
+    (None is unlimited, 0 pauses), split evenly among the active streams (see
+    `TokenBucket`).
+
+    `set` changes them at any time. With a `schedule` (see `parse_schedule`), a
+    list of ("HH:MM", download, upload) sorted by time, they follow the local time
+    of the day instead, e.g. to leave room for the office during business hours.
+    """
+
+    def __init__(self, download=None, upload=None, schedule=None):
+        # the waiting streams follow the schedule too, e.g. to end a pause
+        self.buckets = {
+            "download": TokenBucket(download, refresh=self._follow),
+            "upload": TokenBucket(upload, refresh=self._follow),
+        }
+        self.schedule = schedule
+        self._checked = 0.0
+
+    def set(self, download=None, upload=None):
+        """Fixed limits, instead of the schedule"""
+        self.schedule = None
+        self.buckets["download"].set_rate(download)
+        self.buckets["upload"].set_rate(upload)
+
+    def limits_at(self, moment):
+        """The (download, upload) limits of the schedule at the datetime `moment`"""
+        # the last period of the day goes on after midnight
+        current = self.schedule[-1]
+        for period in self.schedule:
+            if period[0] <= moment.strftime("%H:%M"):
+                current = period
+        return current[1:]
+
+    def _follow(self):
+        if self.schedule and time.monotonic() - self._checked > 10:
+            self._checked = time.monotonic()
+            download, upload = self.limits_at(datetime.datetime.now())
+            self.buckets["download"].set_rate(download)
+            self.buckets["upload"].set_rate(upload)
+
+    def limited(self, direction):
+        self._follow()
+        return self.buckets[direction].rate is not None
+
+    def take(self, direction, nbytes):
+        """Block until `nbytes` to "download" or "upload" fit in the limits"""
+        self._follow()
+        self.buckets[direction].take(nbytes)
+
+
+# the limits of all the transfers (unlimited unless they are set)
+BANDWIDTH = Bandwidth()
+
+
+class _Download:
+    """
+    Sequential reader of the =dv download from `offset` on.
+
+    When the connection fails it's reopened with a Range request at the first
+    missing byte, according to the `retry` budget. The reads are limited by
+    `bandwidth` (`BANDWIDTH` by default).
+    """
+
+    def __init__(
+        self, offset, size, chunksize, reopen, retry, metrics, stream=None, bandwidth=None
+    ):
+        self.offset = offset  # absolute position of the next byte to return
+        self.size = size
+        self.chunksize = chunksize
+        self.reopen = reopen
+        self.retry = retry
+        self.metrics = metrics
+        self.bandwidth = bandwidth or BANDWIDTH
+        self.closed = False
+        self.stream = None
+        self._iter = iter(())
+        self._position = 0  # absolute position of the next byte of self._iter
+        self._broken = stream is None
+        if stream is not None:
+            self._attach(stream)
+
+    def _attach(self, stream):
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = stream
+        self._iter = stream.iter_content(chunk_size=self.chunksize)
+        self._position = stream_offset(stream)
+        # time to the headers of the download, redirects included
+        elapsed = sum(r.elapsed.total_seconds() for r in (*stream.history, stream))
+        self.metrics.on_connect(elapsed, self._position)
+
+    def _next(self):
+        if self._broken:
+            self._attach(self.reopen(self.offset))
+            self._broken = False
+        chunk = next(self._iter, None)
+        if chunk is None and self._position < self.size:
+            raise httplib.IncompleteRead(b"", self.size - self._position)
+        return chunk
+
+    def _on_error(self, error):
+        if self.reopen is None or self.closed:
+            raise error
+        self.metrics.on_retry("download", error)
+        self._broken = True
+
+    def read(self):
+        """Return a memoryview with the next bytes, or None at the end of the video"""
+        started = time.monotonic()
+        while True:
+            chunk = self.retry.call(self._next, on_retry=self._on_error)
+            if chunk is None:
+                return None
+            start = self._position
+            self._position += len(chunk)
+            # skip what's before the offset (e.g. the server ignored the Range)
+            if self._position > self.offset:
+                piece = memoryview(chunk)[max(self.offset - start, 0):]
+                self.offset = self._position
+                self.bandwidth.take("download", len(piece))
+                self.metrics.on_download(len(piece), time.monotonic() - started)
+                return piece
+
+    def close(self):
+        self.closed = True
+        if self.stream is not None:
+            self.stream.close()
+
+
+class _ReadAhead:
+    """
+    Keep a fixed pool of `blocks` reusable buffers filled with the next bytes of
+    `download` from a background thread, so the download goes on while the
+    current chunk is being uploaded. Memory is bounded to `blocks * block_size`.
+    """
+
+    def __init__(self, download, blocks, block_size):
+        self._download = download
+        self._free = queue.Queue()
+        for _ in range(blocks):
+            self._free.put(bytearray(block_size))
+        self._filled = queue.Queue()
+        self._current = None
+        self._eof = False
+        self._closed = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        pending = memoryview(b"")
+        while pending is not None:
+            buffer = self._free.get()
+            if self._closed:
+                return
+            size = 0
+            try:
+                while size < len(buffer):
+                    if not pending:
+                        pending = self._download.read()
+                        if pending is None:
+                            break
+                    n = min(len(pending), len(buffer) - size)
+                    buffer[size : size + n] = pending[:n]
+                    pending = pending[n:]
+                    size += n
+            except Exception as error:
+                self._filled.put(error)
+                return
+            self._filled.put((buffer, size))
+
+    def read(self):
+        # the consumer is done with the previous block once it asks for the next
+        if self._current is not None:
+            self._free.put(self._current)
+            self._current = None
+        if self._eof:
+            return None
+        item = self._filled.get()
+        if isinstance(item, Exception):
+            raise item
+        buffer, size = item
+        # a partial block is the last one
+        self._eof = size < len(buffer)
+        if not size:
+            self._free.put(buffer)
+            return None
+        self._current = buffer
+        return memoryview(buffer)[:size]
+
+    def close(self):
+        self._closed = True
+        self._free.put(None)
+        self._download.close()
+
+
+class _ThrottledBody:
+    """
+    Body of an upload request that takes the `bandwidth` while it's written.
+
+    http.client sends an iterable body piece by piece, so a chunk goes out at the
+    limited rate instead of in a burst after waiting for all of it. Each iteration
+    starts over, so a request sent again is throttled again.
+    """
+
+    def __init__(self, data, bandwidth, quantum=64 * 1024):
+        self.data = data
+        self.bandwidth = bandwidth
+        self.quantum = quantum
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for start in range(0, len(self.data), self.quantum):
+            piece = self.data[start : start + self.quantum]
+            self.bandwidth.take("upload", len(piece))
+            yield piece
+
+
+class MediaStreamUpload(googleapiclient.http.MediaUpload):
+    """
+    Feed a resumable upload straight from a streamed download.
+
+    `reopen(offset)` must return a new download starting at `offset`. It's used
+    when the upload continues from a position the current stream can't provide,
+    like resuming a checkpoint, and to reconnect when the download fails.
+    If `stream` is None the download is opened lazily at the first requested byte,
+    so `size` and `mimetype` must be given.
+
+    With `readahead` (in bytes) a background reader keeps downloading up to that
+    amount while chunks are uploaded, instead of alternating download and upload.
+
+    With `adaptive`, `chunksize` is only the initial size of the upload chunks and
+    it's tuned after each chunk by an `AdaptiveChunkSize`.
+
+    The download and the buffering are measured in `metrics` (a `TransferMetrics`),
+    and both the download and the upload are limited by `bandwidth` (a `Bandwidth`,
+    `BANDWIDTH` by default).
+    The sha256 of the video is computed from the bytes as they are uploaded, see
+    `content_hash`.
+    """
+
+    def __init__(
+        self,
+        stream=None,
+        chunksize=DEFAULT_CHUNK_SIZE,
+        resumable=True,
+        reopen=None,
+        size=None,
+        mimetype=None,
+        retry=None,
+        readahead=0,
+        adaptive=False,
+        metrics=None,
+        bandwidth=None,
+    ):
+
+        super(MediaStreamUpload, self).__init__()
+
+        if stream is None and reopen is None:
+            raise ValueError("either stream or reopen is required")
+        self._resumable = resumable
+        if not (chunksize == -1 or chunksize > 0):
+            raise ValueError("invalid chunksize error")
+        self._chunksize = chunksize
+        self.adaptive = AdaptiveChunkSize(chunksize) if adaptive else None
+        self._reopen = reopen
+        self._retry = retry or Retry()
+        self._readahead = readahead
+        self.metrics = metrics or TransferMetrics()
+        self.bandwidth = bandwidth or BANDWIDTH
+        self._mimetype = mimetype or stream.headers["content-type"]
+        self._size = size if size is not None else stream_size(stream)
+
+        # bytes [cursor, cursor + filled) of the video are in the window, followed
+        # by the pending part of the last piece read from the source
+        self._source = None
+        self._cursor = 0
+        self._window = bytearray(max(chunksize, 0))
+        self._filled = 0
+        self._pending = memoryview(b"")
+        self._waited = 0.0  # seconds blocked reading the source
+        self._hash = hashlib.sha256()
+        self._hashed = 0  # bytes hashed, None if some were never read (resumed upload)
+        if stream is not None:
+            self._open(stream_offset(stream), stream)
+
+    def _open(self, offset, stream=None):
+        if self._source is not None:
+            self._source.close()
+        read_size = self._chunksize if self._chunksize > 0 else DEFAULT_CHUNK_SIZE
+        source = _Download(
+            offset,
+            self._size,
+            read_size,
+            self._reopen,
+            self._retry,
+            self.metrics,
+            stream,
+            self.bandwidth,
+        )
+        if self._readahead:
+            block_size = min(read_size, self._readahead)
+            source = _ReadAhead(source, self._readahead // block_size, block_size)
+        self._source = source
+        self._cursor = offset
+        self._filled = 0
+        self._pending = memoryview(b"")
+
+    def _read(self):
+        started = time.monotonic()
+        try:
+            return self._source.read()
+        finally:
+            self._waited += time.monotonic() - started
+
+    def _advance(self, n):
+        """Discard the next `n` bytes (the server already has them)"""
+        dropped = min(n, self._filled)
+        if dropped:
+            view = memoryview(self._window)
+            view[: self._filled - dropped] = view[dropped : self._filled]
+            self._filled -= dropped
+        while dropped < n:
+            if not self._pending:
+                self._pending = self._read()
+                if self._pending is None:
+                    self._pending = memoryview(b"")
+                    break
+            skip = min(len(self._pending), n - dropped)
+            self._pending = self._pending[skip:]
+            dropped += skip
+        self._cursor += dropped
+
+    def chunksize(self):
+        if self.adaptive:
+            return self.adaptive.size
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return self._resumable
+
+    def getbytes(self, begin, length):
+        started = time.monotonic()
+        self._waited = 0.0
+        if self._source is None or begin < self._cursor:
+            if self._source is not None and self._reopen is None:
+                raise ValueError(f"can't go back to byte {begin} without reopen")
+            self._open(begin)
+        self._advance(begin - self._cursor)
+        if len(self._window) < length:
+            window = bytearray(length)
+            window[: self._filled] = memoryview(self._window)[: self._filled]
+            self._window = window
+        while self._filled < length:
+            if not self._pending:
+                self._pending = self._read()
+                if self._pending is None:
+                    # a short read means EOF to googleapiclient
+                    self._pending = memoryview(b"")
+                    break
+            n = min(len(self._pending), length - self._filled)
+            self._window[self._filled : self._filled + n] = self._pending[:n]
+            self._pending = self._pending[n:]
+            self._filled += n
+        # a view of the window, it's sent before the next call changes it
+        data = memoryview(self._window)[: min(self._filled, length)]
+        self.metrics.on_buffer(begin, len(data), time.monotonic() - started, self._waited)
+        if self._hashed is not None:
+            if begin > self._hashed:
+                self._hashed = None
+            elif begin + len(data) > self._hashed:
+                # chunks sent again after an error are hashed only once
+                self._hash.update(data[self._hashed - begin :])
+                self._hashed = begin + len(data)
+        if self.bandwidth.limited("upload"):
+            return _ThrottledBody(data, self.bandwidth)
+        return data
+
+    def content_hash(self):
+        """sha256 of the video, if all of it went through this upload"""
+        return self._hash.hexdigest() if self._hashed == self._size else None
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def has_stream(self):
+        return False  # True
+
+    def to_json(self):
+        """This upload type is not serializable."""
+        raise NotImplementedError("MediaIoBaseUpload is not serializable.")
+
+
+DEFAULT_TAGS = ("google-photos-to-youtube",)
+
+
+def default_title(video):
+    return video.get("description") or video.get("filename", "")
+
+
+def default_description(video):
+    return "\n - ".join(
+        [
+            "",
+            "Migrado desde Google Photos con http://github.com/mgaitan/google-photos-to-youtube",
+            f"Fecha de subida original: {video['mediaMetadata']['creationTime']}",
+            f"Google photo ID:  {video['id']}",
+            f"Url original:  {video['productUrl']}",
+        ]
+    )
+
+
+def fingerprint(video, size):
+    """
+    Identify the content of a video by its metadata, to spot the copies of the
+    same file (uploaded twice, or from another device) before transferring them.
+    """
+    metadata = video.get("mediaMetadata", {})
+    return hashlib.sha256(
+        "|".join(
+            [
+                video.get("filename", "").lower(),
+                metadata.get("creationTime", ""),
+                str(size),
+                f"{metadata.get('width', '')}x{metadata.get('height', '')}",
+            ]
+        ).encode()
+    ).hexdigest()
+
+
+def prefetched(iterator, depth=2):
+    """
+    Iterate `iterator` in a background thread, keeping up to `depth` items ready
+    ahead of the consumer. Errors are raised to the consumer when it gets there.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def produce():
+        try:
+            for item in iterator:
+                put(item)
+                if stop.is_set():
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _is_video(item):
+    return "video" in item.get("mediaMetadata", {})
+
+
+def _pages(session, page_size, filters, album_id=None, where=None):
+    token = None
+    while True:
+        page = get_videos(session, token, page_size, filters, album_id)
+        items = page.get("mediaItems", [])
+        if album_id:
+            items = [item for item in items if _is_video(item)]
+        if where is not None:
+            items = _matching(session, items, where)
+        yield items
+        token = page.get("nextPageToken")
+        if not token:
+            return
+
+
+def iter_pages(
+    session, page_size=MAX_PAGE_SIZE, filters=None, prefetch=2, album_id=None, where=None
+):
+    """
+    Lazily yield the pages (lists of videos) of the library. The next `prefetch`
+    pages are requested in the background while the current ones are processed.
+
+    `filters` and `album_id` are applied by the API (see `get_videos`), `where`
+    (a predicate on each video, see `Where`) as the pages arrive, so the pages can
+    be shorter than `page_size`, even empty.
+    """
+    return prefetched(_pages(session, page_size, filters, album_id, where), prefetch)
+
+
+def iter_videos(session, page_size=MAX_PAGE_SIZE, filters=None, album_id=None, where=None):
+    """Yield every video of the library, following the pagination of get_videos"""
+    for page in iter_pages(session, page_size, filters, album_id=album_id, where=where):
+        yield from page
+
+
+class Where:
+    """
+    A test on a video, composable with &, | and ~::
+
+        where = resolution(minimum=1080) & ~created(end=datetime.date(2015, 1, 1))
+
+    The ones with `needs_sizes` test the videos once `fetch_sizes` sized them
+    (see `select`).
+    """
+
+    def __init__(self, test, needs_sizes=False):
+        self.test = test
+        self.needs_sizes = needs_sizes
+
+    def __call__(self, video):
+        return self.test(video)
+
+    def _needs_sizes(self, other):
+        return self.needs_sizes or getattr(other, "needs_sizes", False)
+
+    def __and__(self, other):
+        return Where(lambda video: self(video) and other(video), self._needs_sizes(other))
+
+    def __or__(self, other):
+        return Where(lambda video: self(video) or other(video), self._needs_sizes(other))
+
+    def __invert__(self):
+        return Where(lambda video: not self(video), self.needs_sizes)
+
+
+def _matching(session, videos, where, index=None):
+    """The `videos` of a batch that pass `where`, sized first if it needs it"""
+    if getattr(where, "needs_sizes", False):
+        fetch_sizes(session, videos, index=index)
+    return [video for video in videos if where(video)]
+
+
+def select(session, videos, where, index=None, batch=MAX_PAGE_SIZE):
+    """
+    Yield the `videos` that pass `where`. If it needs the sizes they're asked with
+    `fetch_sizes` in batches, cached in `index` (which also refreshes the stale
+    baseUrls of its videos).
+    """
+    videos = iter(videos)
+    while True:
+        chunk = list(itertools.islice(videos, batch))
+        if not chunk:
+            return
+        yield from _matching(session, chunk, where, index)
+
+
+def _within(value, minimum, maximum):
+    if value is None:
+        return False
+    return (minimum is None or value >= minimum) and (maximum is None or value <= maximum)
+
+
+def created(start=None, end=None):
+    """Videos created from the date `start` to `end` (both included)"""
+    return Where(
+        lambda video: _within(
+            video.get("mediaMetadata", {}).get("creationTime", "")[:10],
+            start and start.isoformat(),
+            end and end.isoformat(),
+        )
+    )
+
+
+def resolution(minimum=None, maximum=None):
+    """Videos whose shorter side (1080 for a 1080p one, portrait or not) is in the range"""
+
+    def test(video):
+        metadata = video.get("mediaMetadata", {})
+        sides = [int(metadata.get(side, 0)) for side in ("width", "height")]
+        return _within(min(sides) or None, minimum, maximum)
+
+    return Where(test)
+
+
+def frame_rate(minimum=None, maximum=None):
+    return Where(
+        lambda video: _within(
+            video.get("mediaMetadata", {}).get("video", {}).get("fps"), minimum, maximum
+        )
+    )
+
+
+def file_size(minimum=None, maximum=None):
+    """
+    Videos of `minimum` to `maximum` bytes, as sized by `fetch_sizes` (see `select`).
+    The videos of unknown size don't match.
+    """
+    return Where(lambda video: _within(video_size(video), minimum, maximum), needs_sizes=True)
+
+
+def get_media_items(session, item_ids):
+    """Fetch fresh copies of up to 50 media items in a single request"""
+    response = session.get(
+        "https://photoslibrary.googleapis.com/v1/mediaItems:batchGet",
+        params={"mediaItemIds": list(item_ids)},
+    )
+    response.raise_for_status()
+    return [
+        result["mediaItem"]
+        for result in response.json().get("mediaItemResults", [])
+        if "mediaItem" in result
+    ]
+
+
+def _date(date):
+    """A datetime.date as a Photos API Date"""
+    return {"year": date.year, "month": date.month, "day": date.day}
+
+
+class LibraryIndex:
+    """
+    Persistent local index of the videos of the Google Photos library.
+
+    The first `sync` lists the whole library, the next ones only ask for the
+    videos created since the newest one already indexed (the API filters by whole
+    days, so the last day is listed again). Videos added later with an older
+    creation time are only found by a `sync(session, full=True)`.
+
+    Items are returned as the API returns them, plus the `_size` of the ones whose
+    size is known (see `fetch_sizes`). Their baseUrl expires after an hour,
+    `refresh` renews the stale ones in batches.
+    """
+
+    # baseUrls are valid for 60 minutes
+    BASE_URL_TTL = 55 * 60
+
+    def __init__(self, path="library.sqlite"):
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS media (
+                id TEXT PRIMARY KEY,
+                product_url TEXT NOT NULL,
+                filename TEXT,
+                mime_type TEXT,
+                creation_time TEXT,
+                width INTEGER,
+                height INTEGER,
+                fps REAL,
+                fetched_at REAL,
+                item TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS media_creation_time ON media (creation_time);
+            CREATE INDEX IF NOT EXISTS media_product_url ON media (product_url);
+            CREATE TABLE IF NOT EXISTS sizes (id TEXT PRIMARY KEY, size INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+
+    def _query(self, sql, *params):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self._query("SELECT count(*) FROM media")[0][0]
+
+    def add(self, items):
+        fetched_at = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN")
+            for item in items:
+                metadata = item.get("mediaMetadata", {})
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        item["id"],
+                        item["productUrl"],
+                        item.get("filename"),
+                        item.get("mimeType"),
+                        metadata.get("creationTime"),
+                        int(metadata.get("width", 0)) or None,
+                        int(metadata.get("height", 0)) or None,
+                        metadata.get("video", {}).get("fps"),
+                        fetched_at,
+                        json.dumps(item, separators=(",", ":")),
+                    ),
+                )
+            self.conn.execute("COMMIT")
+
+    def sync(self, session, full=False, page_size=MAX_PAGE_SIZE):
+        """Index the videos created since the last sync. Return how many were listed"""
+        watermark = None if full else self.watermark()
+        filters = None
+        if watermark:
+            start = datetime.date.fromisoformat(watermark[:10])
+            end = datetime.date.today() + datetime.timedelta(days=1)
+            filters = {"dateFilter": {"ranges": [{"startDate": _date(start), "endDate": _date(end)}]}}
+        listed = 0
+        for page in iter_pages(session, page_size, filters):
+            # each page is stored as soon as it arrives, an interrupted sync isn't lost
+            self.add(page)
+            listed += len(page)
+        return listed
+
+    def watermark(self):
+        """creationTime of the newest indexed video"""
+        return self._query("SELECT max(creation_time) FROM media")[0][0]
+
+    def videos(self, offset=0, limit=-1):
+        """Return the indexed videos, newest first like the API"""
+        rows = self._query(
+            "SELECT item, fetched_at, size FROM media LEFT JOIN sizes USING (id) "
+            "ORDER BY creation_time DESC, id LIMIT ? OFFSET ?",
+            limit,
+            offset,
+        )
+        videos = []
+        for item, fetched_at, size in rows:
+            video = dict(json.loads(item), _fetched_at=fetched_at)
+            if size is not None:
+                video["_size"] = size
+            videos.append(video)
+        return videos
+
+    def __iter__(self):
+        offset = 0
+        while True:
+            videos = self.videos(offset, 500)
+            yield from videos
+            if len(videos) < 500:
+                return
+            offset += len(videos)
+
+    def sizes(self, ids):
+        """Known sizes of the videos with the given `ids`"""
+        ids = list(ids)
+        sizes = {}
+        # sqlite limits the parameters of a query
+        for start in range(0, len(ids), 500):
+            batch = ids[start : start + 500]
+            sizes.update(
+                self._query(
+                    f"SELECT id, size FROM sizes WHERE id IN ({','.join('?' * len(batch))})",
+                    *batch,
+                )
+            )
+        return sizes
+
+    def set_sizes(self, sizes):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sizes VALUES (?, ?)", list(sizes.items())
+            )
+
+    def pages(self, session, page_size=MAX_PAGE_SIZE, prefetch=2):
+        """Like iter_pages, but read from the index with fresh baseUrls"""
+
+        def pages():
+            offset = 0
+            while True:
+                videos = self.videos(offset, page_size)
+                if not videos:
+                    return
+                yield self.refresh(session, videos)
+                offset += len(videos)
+
+        return prefetched(pages(), prefetch)
+
+    def refresh(self, session, videos):
+        """Renew the expired baseUrls of `videos` (in place) and return them"""
+        stale = {
+            video["id"]: video
+            for video in videos
+            if time.time() - video.get("_fetched_at", 0) > self.BASE_URL_TTL
+        }
+        ids = list(stale)
+        for start in range(0, len(ids), 50):
+            items = get_media_items(session, ids[start : start + 50])
+            self.add(items)
+            for item in items:
+                stale[item["id"]].update(item, _fetched_at=time.time())
+        return videos
+
+
+def _head_size(session, video):
+    try:
+        return get_size(session, video)
+    except (requests.RequestException, KeyError, ValueError) as e:
+        print(f"⚠️  size of {default_title(video)} unknown: {e!r}")
+        return None
+
+
+def fetch_sizes(session, videos, index=None, workers=16):
+    """
+    Set the `_size` of `videos` with concurrent HEAD requests of their downloads,
+    a cheap metadata pass (the API doesn't tell sizes). Sizes already known, in
+    the videos or cached in `index`, aren't asked again. Return `videos`.
+    """
+    missing = [video for video in videos if "_size" not in video]
+    if index is not None and missing:
+        known = index.sizes(video["id"] for video in missing)
+        for video in missing:
+            if video["id"] in known:
+                video["_size"] = known[video["id"]]
+        missing = [video for video in missing if "_size" not in video]
+        # the baseUrls of the videos read from the index may have expired
+        index.refresh(session, [video for video in missing if "_fetched_at" in video])
+    if not missing:
+        return videos
+    size_pool(session, workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        sizes = pool.map(lambda video: _head_size(session, video), missing)
+        for video, size in zip(missing, sizes):
+            video["_size"] = size
+    if index is not None:
+        index.set_sizes({v["id"]: v["_size"] for v in missing if v["_size"] is not None})
+    return videos
+
+
+def video_size(video):
+    """Size of `video` from `fetch_sizes`, None if unknown"""
+    return video.get("_size")
+
+
+class OrderPolicy:
+    """
+    Order in which a batch of videos is transferred. Policies are called with a
+    list of videos and return them sorted; the ones with `needs_sizes` get them
+    from `fetch_sizes` first. The base policy keeps the given order.
+    """
+
+    needs_sizes = False
+
+    def __call__(self, videos):
+        return list(videos)
+
+
+class SmallestFirst(OrderPolicy):
+    """More videos done sooner, big files don't hold the small ones back"""
+
+    needs_sizes = True
+
+    def __call__(self, videos):
+        # unknown sizes go last
+        return sorted(videos, key=lambda v: (video_size(v) is None, video_size(v) or 0))
+
+
+class LargestFirst(OrderPolicy):
+    """Long transfers start early and the small ones fill the gaps at the end"""
+
+    needs_sizes = True
+
+    def __call__(self, videos):
+        return sorted(videos, key=lambda v: (video_size(v) is None, -(video_size(v) or 0)))
+
+
+class OldestFirst(OrderPolicy):
+    """By creationTime, the oldest memories first"""
+
+    def __call__(self, videos):
+        return sorted(videos, key=lambda v: v.get("mediaMetadata", {}).get("creationTime", ""))
+
+
+class FitWindow(OrderPolicy):
+    """
+    Put first the videos that fit in a window of `count` uploads (the ones the
+    quota allows) and of `seconds` at `bandwidth` bytes per second, then the rest
+    smallest first.
+
+    When the uploads are limited the biggest videos that fit are chosen, so the
+    quota moves as many bytes as the window allows. Otherwise the smallest ones
+    are, to finish as many videos as possible.
+    """
+
+    needs_sizes = True
+
+    def __init__(self, count=None, seconds=None, bandwidth=None):
+        self.count = count
+        self.seconds = seconds
+        self.bandwidth = bandwidth
+
+    def __call__(self, videos):
+        budget = float("inf")
+        if self.seconds and self.bandwidth:
+            budget = self.seconds * self.bandwidth
+        candidates = LargestFirst()(videos) if self.count else SmallestFirst()(videos)
+        chosen = []
+        rest = []
+        for video in candidates:
+            size = video_size(video)
+            if (
+                size is not None
+                and size <= budget
+                and (self.count is None or len(chosen) < self.count)
+            ):
+                chosen.append(video)
+                budget -= size
+            else:
+                rest.append(video)
+        return chosen + SmallestFirst()(rest)
+
+
+ORDER_POLICIES = {
+    "api": OrderPolicy,
+    "smallest": SmallestFirst,
+    "largest": LargestFirst,
+    "oldest": OldestFirst,
+    "fit": FitWindow,
+}
+
+
+# connections kept alive per host by the Photos session
+POOL_SIZE = 16
+
+
+@functools.lru_cache()
+def discovery_document(service="youtube", version="v3"):
+    """The discovery document shipped with googleapiclient, parsed once"""
+    from googleapiclient import discovery_cache
+
+    return json.loads(discovery_cache.get_static_doc(service, version))
+
+
+def youtube_client(credentials):
+    """A YouTube client with its own connection, built from the cached discovery document"""
+    # googleapiclient.discovery is slow to import, only the uploads need it
+    from googleapiclient.discovery import build_from_document
+
+    return build_from_document(discovery_document(), credentials=credentials)
+
+
+def size_pool(session, connections):
+    """
+    Let `session` keep up to `connections` alive per host, one for each worker.
+
+    Past the size of the pool, requests opens a connection for each request and
+    throws it away afterwards, paying the TCP and TLS handshakes every time.
+    """
+    if getattr(session.get_adapter("https://"), "_pool_maxsize", 0) >= connections:
+        return
+    for prefix in ("https://", "http://"):
+        session.mount(prefix, requests.adapters.HTTPAdapter(pool_maxsize=connections))
+
+
+_worker_state = threading.local()
+
+
+def worker_youtube(youtube):
+    """
+    Return a YouTube client owned by the current thread.
+
+    googleapiclient resources sit on a single httplib2.Http that isn't thread-safe,
+    so each worker builds its own client sharing the credentials of `youtube`.
+    The client keeps its connection alive between the chunks of the uploads.
+    """
+    clients = getattr(_worker_state, "youtube", None)
+    if clients is None:
+        clients = _worker_state.youtube = {}
+    if id(youtube) not in clients:
+        clients[id(youtube)] = youtube_client(youtube._http.credentials)
+    return clients[id(youtube)]
+
+
+def _write_json(path, data):
+    # write and rename, so a crash never leaves a truncated file
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2))
+    os.replace(tmp, path)
+
+
+class Checkpoints:
+    """
+    State of the unfinished resumable uploads (YouTube session uri, confirmed offset,
+    size and mimetype) keyed by Google Photos id.
+
+    It's persisted in a local json file after every accepted chunk, so a transfer
+    interrupted by a crash or a kernel restart continues where it stopped.
+    """
+
+    def __init__(self, path="checkpoints.json"):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.data = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def save(self, key, **state):
+        with self.lock:
+            self.data[key] = state
+            self._write()
+
+    def discard(self, key):
+        with self.lock:
+            if self.data.pop(key, None) is not None:
+                self._write()
+
+    def _write(self):
+        _write_json(self.path, self.data)
+
+
+def migrate_video(
+    session,
+    youtube,
+    video,
+    title=None,
+    description=None,
+    privacy_status="private",
+    tags=DEFAULT_TAGS,
+    progress=None,
+    checkpoints=None,
+    readahead=DEFAULT_READAHEAD,
+    chunksize=DEFAULT_CHUNK_SIZE,
+    adaptive=True,
+    dedupe=True,
+    on_duplicate=None,
+):
+    """
+    Transfer a single video from Google Photos to YouTube and record it in the DB.
+
+    With `checkpoints`, an upload interrupted in a previous run is resumed from the
+    offset YouTube already committed instead of starting from scratch.
+    `readahead` is the amount of bytes downloaded in advance while uploading.
+    Unless `adaptive` is False, `chunksize` is tuned to the link during the upload.
+    The transfer is measured in a `TransferMetrics` named after the video id, so
+    its events reach the subscribers of `METRICS`.
+    With `dedupe`, a video with the same `fingerprint` as one already migrated is
+    not uploaded again, it's recorded with the youtube url of the first copy and
+    `on_duplicate` is called with the (gphoto url, youtube url) of that copy.
+    An upload with the same content hash as a migrated video is recorded with the
+    url of the first copy too, as YouTube rejects it.
+    """
+    db = DB(session)
+    state = checkpoints.get(video["id"]) if checkpoints else None
+    retry = Retry()
+    metrics = TransferMetrics(video["id"])
+
+    def reopen(offset):
+        try:
+            return get_stream(session, video, offset)
+        except requests.HTTPError as e:
+            if http_status(e) != 403:
+                raise
+            # the baseUrl expired during a long transfer
+            video.update(get_media_item(session, video["id"]))
+            return get_stream(session, video, offset)
+
+    if state:
+        media = MediaStreamUpload(
+            reopen=reopen,
+            size=state["size"],
+            mimetype=state["mimetype"],
+            retry=retry,
+            readahead=readahead,
+            chunksize=chunksize,
+            adaptive=adaptive,
+            metrics=metrics,
+        )
+    else:
+        # open it before the upload, which starts reading ahead right away
+        stream = retry.call(reopen, 0)
+        duplicate = dedupe and db.find_duplicate(
+            fingerprint=fingerprint(video, stream_size(stream))
+        )
+        if duplicate:
+            stream.close()
+            print(f"🔗 {default_title(video)} is a duplicate of {duplicate[0]}")
+            db[video["productUrl"]] = duplicate[1]
+            if on_duplicate is not None:
+                on_duplicate(duplicate)
+            return duplicate[1]
+        media = MediaStreamUpload(
+            stream,
+            reopen=reopen,
+            retry=retry,
+            readahead=readahead,
+            chunksize=chunksize,
+            adaptive=adaptive,
+            metrics=metrics,
+        )
+    if progress is not None:
+        progress.max = media.size()
+
+    def on_chunk(resumable_uri, offset):
+        checkpoints.save(
+            video["id"],
+            uri=resumable_uri,
+            offset=offset,
+            size=media.size(),
+            mimetype=media.mimetype(),
+        )
+
+    try:
+        response = upload_stream(
+            youtube,
+            media,
+            title=title or default_title(video),
+            description=default_description(video) if description is None else description,
+            tags=tags,
+            privacy_status=privacy_status,
+            progress=progress,
+            resumable_uri=state["uri"] if state else None,
+            on_chunk=on_chunk if checkpoints else None,
+            retry=retry,
+        )
+    except googleapiclient.errors.HttpError as e:
+        if not state or e.resp.status not in (404, 410):
+            raise
+        # the upload session expired, start over
+        checkpoints.discard(video["id"])
+        return migrate_video(
+            session,
+            youtube,
+            video,
+            title=title,
+            description=description,
+            privacy_status=privacy_status,
+            tags=tags,
+            progress=progress,
+            checkpoints=checkpoints,
+            readahead=readahead,
+            chunksize=chunksize,
+            adaptive=adaptive,
+            dedupe=dedupe,
+        )
+    content_hash = media.content_hash()
+    first = dedupe and content_hash and db.find_duplicate(content_hash=content_hash)
+    if first:
+        # the fingerprint missed it, YouTube rejects the second upload of a file
+        print(
+            f"🔗 {default_title(video)} has the same bytes as {first[0]}, "
+            f"{response} will be rejected as a duplicate"
+        )
+        response = first[1]
+    db[video["productUrl"]] = response
+    db.set_content(video["productUrl"], content_hash, fingerprint(video, media.size()))
+    if checkpoints:
+        checkpoints.discard(video["id"])
+    return response
+
+
+def migrate(
+    session,
+    youtube,
+    videos=None,
+    workers=4,
+    privacy_status="private",
+    tags=DEFAULT_TAGS,
+    limit=None,
+    checkpoints=None,
+    readahead=DEFAULT_READAHEAD,
+    chunksize=DEFAULT_CHUNK_SIZE,
+    adaptive=True,
+    index=None,
+    order=None,
+    dedupe=True,
+    filters=None,
+    album_id=None,
+    where=None,
+    on_result=None,
+):
+    """
+    Headless migration engine.
+
+    Walk the library (or the given `videos`), skip the ones already in the DB and
+    transfer the rest running `workers` uploads concurrently on a thread pool.
+    Pass a `Checkpoints` instance to resume uploads interrupted in a previous run.
+    Each transfer buffers up to `readahead` bytes of its download in advance and
+    starts uploading chunks of `chunksize` bytes, adapted to the link if `adaptive`.
+    With a `LibraryIndex`, it's synced and the videos are read from it instead of
+    listing the whole library again.
+    `filters` and `album_id` narrow down the listing in the API (see `get_videos`),
+    without the index, and `where` (see `Where`) picks the videos as they come.
+    With an `order` (an `OrderPolicy`) the pending videos are sorted before
+    starting, which needs the whole list (and their sizes, for some policies).
+    Unless `dedupe` is False, likely duplicates of migrated videos are linked to
+    them instead of uploaded.
+    Return a dict mapping the gphoto url to the youtube url, or to the exception
+    raised while migrating it. `on_result(video, result)` is called as each one
+    finishes.
+    """
+    db = DB(session)
+    if videos is None and (filters or album_id):
+        # the API lists just the selection, faster than syncing the whole index
+        videos = iter_videos(session, filters=filters, album_id=album_id)
+    elif videos is None and index is not None:
+        print(f"🔎 {index.sync(session)} new videos indexed, {len(index)} in total")
+        videos = iter(index)
+    elif videos is None:
+        videos = iter_videos(session)
+    if where is not None:
+        # the migrated ones aren't sized for nothing
+        videos = (video for video in videos if video["productUrl"] not in db)
+        videos = select(session, videos, where, index=index)
+    if order is not None:
+        videos = [video for video in videos if video["productUrl"] not in db]
+        if order.needs_sizes:
+            fetch_sizes(session, videos, index=index)
+        videos = order(videos)
+
+    def work(video):
+        return migrate_video(
+            session,
+            worker_youtube(youtube),
+            video,
+            privacy_status=privacy_status,
+            tags=tags,
+            checkpoints=checkpoints,
+            readahead=readahead,
+            chunksize=chunksize,
+            adaptive=adaptive,
+            dedupe=dedupe,
+        )
+
+    results = {}
+    pending = {}
+
+    def collect(done):
+        for future in done:
+            video = pending.pop(future)
+            try:
+                results[video["productUrl"]] = future.result()
+                print(f"✅ {default_title(video)} -> {results[video['productUrl']]}")
+            except Exception as e:
+                results[video["productUrl"]] = e
+                print(f"❌ {default_title(video)} failed: {e}")
+            if on_result is not None:
+                on_result(video, results[video["productUrl"]])
+
+    submitted = 0
+    size_pool(session, workers)
+    with db.write_behind(), ThreadPoolExecutor(max_workers=workers) as pool:
+        for video in videos:
+            if limit is not None and submitted >= limit:
+                break
+            if video["productUrl"] in db:
+                continue
+            # keep the queue short so listing pages doesn't run far ahead of the uploads
+            while len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending[pool.submit(work, video)] = video
+            submitted += 1
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    return results
+
+
+# https://developers.google.com/youtube/v3/determine_quota_cost
+YOUTUBE_DAILY_QUOTA = 10000
+INSERT_COST = 1600
+LIST_COST = 1
+
+# the YouTube quota is reset at midnight Pacific time
+try:
+    PACIFIC = zoneinfo.ZoneInfo("America/Los_Angeles")
+except zoneinfo.ZoneInfoNotFoundError:  # no tz database (Windows without tzdata)
+    PACIFIC = datetime.timezone(datetime.timedelta(hours=-8))
+
+# errors that won't go away until the quota is reset
+QUOTA_REASONS = ("quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded")
+
+
+def error_reason(error):
+    """The reason of a failed Google API call (like "quotaExceeded"), if any"""
+    if not isinstance(error, googleapiclient.errors.HttpError):
+        return None
+    try:
+        return json.loads(error.content)["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+class Quota:
+    """
+    Units of the YouTube Data API quota spent today by a `project` (the quota is
+    per Google Cloud project, the OAuth client id tells them apart).
+
+    Units are reserved before each call and persisted in `path`, so every run
+    shares the count. When YouTube answers quotaExceeded anyway (e.g. other
+    clients of the project) the day is taken as spent.
+    """
+
+    def __init__(self, path="quota.json", daily=YOUTUBE_DAILY_QUOTA, project="default"):
+        self.path = Path(path)
+        self.daily = daily
+        self.project = project
+        self.lock = threading.Lock()
+        self.data = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    @staticmethod
+    def today():
+        return datetime.datetime.now(PACIFIC).date().isoformat()
+
+    def spent(self):
+        return self.data.get(self.project, {}).get(self.today(), 0)
+
+    def remaining(self):
+        return max(0, self.daily - self.spent())
+
+    def reserve(self, units):
+        """Spend `units` if they fit in today's quota, and tell if they did"""
+        with self.lock:
+            if self.remaining() < units:
+                return False
+            self._set(self.spent() + units)
+            return True
+
+    def release(self, units):
+        """Give back `units` reserved for a call that wasn't made"""
+        with self.lock:
+            self._set(max(0, self.spent() - units))
+
+    def exhaust(self):
+        with self.lock:
+            self._set(self.daily)
+
+    def _set(self, spent):
+        # older days don't matter anymore
+        self.data[self.project] = {self.today(): spent}
+        _write_json(self.path, self.data)
+
+    def next_reset(self):
+        """Seconds until the quota is reset"""
+        now = datetime.datetime.now(PACIFIC)
+        midnight = datetime.datetime.combine(
+            now.date() + datetime.timedelta(days=1), datetime.time(), PACIFIC
+        )
+        return (midnight - now).total_seconds()
+
+
+class JobQueue:
+    """
+    Persistent queue of the videos to migrate, with their metadata and a
+    priority: higher priorities run first, and the oldest jobs among equals.
+
+    It's kept in `path` so a migration spanning weeks survives restarts. A job
+    that failed `max_attempts` times stays in the file with its last error but
+    it isn't run again. With `keep_done` the finished jobs are kept too, until
+    `forget()`, so a `Verifier` can queue them again with the same metadata.
+    """
+
+    def __init__(self, path="jobs.json", max_attempts=3, keep_done=False):
+        self.path = Path(path)
+        self.max_attempts = max_attempts
+        self.keep_done = keep_done
+        self.lock = threading.Lock()
+        self.jobs = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    def __len__(self):
+        return sum(1 for job in self.jobs.values() if not job.get("done"))
+
+    def __contains__(self, video_id):
+        return video_id in self.jobs
+
+    def extend(
+        self,
+        videos,
+        priority=0,
+        title=None,
+        description=None,
+        privacy_status="private",
+        tags=DEFAULT_TAGS,
+    ):
+        """
+        Queue the `videos` not queued yet and return how many they were.
+        `title` and `description` default to the ones derived from each video.
+        """
+        added = 0
+        with self.lock:
+            for video in videos:
+                if video["id"] in self.jobs:
+                    continue
+                self.jobs[video["id"]] = {
+                    "video": video,
+                    "priority": priority,
+                    "title": title,
+                    "description": description,
+                    "privacy_status": privacy_status,
+                    "tags": list(tags),
+                    "added": time.time(),
+                    "attempts": 0,
+                    "error": None,
+                }
+                added += 1
+            _write_json(self.path, self.jobs)
+        return added
+
+    def add(self, video, priority=0, **metadata):
+        return self.extend([video], priority, **metadata)
+
+    def runnable(self, job):
+        return not job.get("done") and job["attempts"] < self.max_attempts
+
+    def requeue(self, video):
+        """
+        Run a finished job of `video` again, keeping its priority and metadata.
+        Return False if there is no such job (it wasn't kept, see `keep_done`).
+        """
+        with self.lock:
+            job = self.jobs.get(video["id"])
+            if job is None:
+                return False
+            job.update(video=video, attempts=0, error=None, done=None)
+            _write_json(self.path, self.jobs)
+        return True
+
+    def next(self, exclude=()):
+        """The job to run next, skipping the video ids in `exclude`"""
+        with self.lock:
+            ready = [
+                job
+                for video_id, job in self.jobs.items()
+                if video_id not in exclude and self.runnable(job)
+            ]
+        return min(ready, key=lambda job: (-job["priority"], job["added"]), default=None)
+
+    def ordered(self, order=None):
+        """
+        The jobs ready to run, by priority and then by `order` (an `OrderPolicy`
+        applied to their videos) or the oldest queued first.
+        """
+        with self.lock:
+            ready = [job for job in self.jobs.values() if self.runnable(job)]
+        by_priority = {}
+        for job in sorted(ready, key=lambda job: job["added"]):
+            by_priority.setdefault(job["priority"], []).append(job)
+        jobs = []
+        for priority in sorted(by_priority, reverse=True):
+            group = by_priority[priority]
+            if order is not None:
+                by_id = {job["video"]["id"]: job for job in group}
+                group = [by_id[video["id"]] for video in order([j["video"] for j in group])]
+            jobs.extend(group)
+        return jobs
+
+    def done(self, video_id):
+        if not self.keep_done:
+            self.forget(video_id)
+            return
+        with self.lock:
+            self.jobs[video_id]["done"] = time.time()
+            _write_json(self.path, self.jobs)
+
+    def forget(self, video_id):
+        with self.lock:
+            if self.jobs.pop(video_id, None) is not None:
+                _write_json(self.path, self.jobs)
+
+    def failed(self, video_id, error):
+        with self.lock:
+            job = self.jobs[video_id]
+            job["attempts"] += 1
+            job["error"] = repr(error)
+            _write_json(self.path, self.jobs)
+
+
+class Scheduler:
+    """
+    Run the jobs of a `JobQueue` within the daily YouTube quota.
+
+    The cost of each upload is reserved in `quota` before dispatching it. When
+    it doesn't fit, or YouTube answers quotaExceeded, nothing else is dispatched
+    until the quota is reset, and the scheduler sleeps until then. Resumed
+    uploads (in `checkpoints`) don't spend quota again, and duplicates linked
+    instead of uploaded (see `migrate_video`) give it back. Jobs failing for any
+    other reason are retried up to the `max_attempts` of the queue.
+    Jobs of the same priority run in the `order` of an `OrderPolicy`, planned
+    again each day. `options` are passed to `migrate_video` (readahead,
+    chunksize, adaptive, dedupe).
+    """
+
+    def __init__(
+        self,
+        session,
+        youtube,
+        queue,
+        quota,
+        workers=4,
+        checkpoints=None,
+        order=None,
+        sleep=time.sleep,
+        **options,
+    ):
+        self.session = session
+        self.youtube = youtube
+        self.queue = queue
+        self.quota = quota
+        self.workers = workers
+        self.checkpoints = checkpoints
+        self.order = order
+        self.sleep = sleep
+        self.options = options
+        size_pool(session, workers)
+        self._plan = collections.deque()
+
+    def _next_job(self, running):
+        """The next job of the plan, which is made again when it runs out"""
+        for replanned in (False, True):
+            while self._plan:
+                job = self._plan.popleft()
+                video_id = job["video"]["id"]
+                # skip the jobs running, done or failed too many times since planned
+                if (
+                    video_id not in running
+                    and self.queue.jobs.get(video_id) is job
+                    and self.queue.runnable(job)
+                ):
+                    return job
+            if not replanned:
+                self._plan.extend(self.queue.ordered(self.order))
+        return None
+
+    def _work(self, job):
+        video = job["video"]
+        if time.time() - video.get("_fetched_at", 0) > LibraryIndex.BASE_URL_TTL:
+            # the baseUrl of a queued video has long expired
+            video = {**get_media_item(self.session, video["id"]), "_fetched_at": time.time()}
+        return migrate_video(
+            self.session,
+            worker_youtube(self.youtube),
+            video,
+            title=job["title"],
+            description=job["description"],
+            privacy_status=job["privacy_status"],
+            tags=job["tags"],
+            checkpoints=self.checkpoints,
+            # a duplicate is linked without an insert, its quota is given back
+            on_duplicate=lambda first: self.quota.release(INSERT_COST),
+            **self.options,
+        )
+
+    def _collect(self, job, future, results):
+        video = job["video"]
+        try:
+            results[video["productUrl"]] = future.result()
+        except Exception as e:
+            results[video["productUrl"]] = e
+            reason = error_reason(e)
+            if reason in QUOTA_REASONS:
+                # it stays queued, it wasn't the video's fault
+                self.quota.exhaust()
+                print(f"⏸️  {default_title(video)}: {reason}, waiting for the quota reset")
+                return
+            self.queue.failed(video["id"], e)
+            print(f"❌ {default_title(video)} failed: {e}")
+        else:
+            self.queue.done(video["id"])
+            print(f"✅ {default_title(video)} -> {results[video['productUrl']]}")
+
+    def run(self, forever=True):
+        """
+        Run jobs until the queue is done, sleeping through the quota resets
+        (or returning at the first one unless `forever`). Return a dict mapping
+        the gphoto url to the youtube url, or to the exception of its last attempt.
+        """
+        db = DB(self.session)
+        results = {}
+        running = {}
+        with db.write_behind(), ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                while len(running) < self.workers:
+                    job = self._next_job({j["video"]["id"] for j in running.values()})
+                    if job is None:
+                        break
+                    video = job["video"]
+                    if video["productUrl"] in db:
+                        self.queue.done(video["id"])
+                        continue
+                    resumed = self.checkpoints and self.checkpoints.get(video["id"])
+                    if not resumed and not self.quota.reserve(INSERT_COST):
+                        self._plan.appendleft(job)
+                        break
+                    running[pool.submit(self._work, job)] = job
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._collect(running.pop(future), future, results)
+                    continue
+                if self.queue.next() is None or not forever:
+                    return results
+                # a minute of margin, in case the clocks disagree
+                delay = self.quota.next_reset() + 60
+                print(
+                    f"😴 {self.quota.spent()} units of quota spent today, "
+                    f"{len(self.queue)} videos queued, resuming in {delay / 3600:.1f}h"
+                )
+                self.sleep(delay)
+                # a new window, plan it again
+                self._plan.clear()
+
+
+def processing_status(item):
+    """
+    Return the ("verified" | "failed" | "processing", reason) of a `videos.list`
+    item with the status and processingDetails parts
+    """
+    status = item.get("status", {})
+    upload_status = status.get("uploadStatus")
+    if upload_status == "processed":
+        return "verified", None
+    if upload_status in ("failed", "rejected", "deleted"):
+        return "failed", status.get("failureReason") or status.get("rejectionReason") or upload_status
+    processing = item.get("processingDetails", {})
+    if processing.get("processingStatus") in ("failed", "terminated"):
+        return "failed", processing.get("processingFailureReason") or processing["processingStatus"]
+    return "processing", None
+
+
+# failures of the upload or the processing that another upload may not repeat,
+# the rest (codec, invalidFile, duplicate, copyright, length...) are permanent
+RETRYABLE_FAILURES = (
+    "conversion",
+    "emptyFile",
+    "uploadAborted",
+    "uploadFailed",
+    "streamingFailed",
+    "transcodeFailed",
+)
+
+
+class Verifier:
+    """
+    Check that YouTube processed the migrated videos.
+
+    `upload_stream` returns once the last chunk is accepted, but YouTube can
+    still fail to process the video or reject it. The verifier polls
+    `videos.list` for the entries of the DB not verified yet, `batch` ids per
+    call (1 unit of `quota` each, if given), and marks them verified or failed.
+    A video that failed for one of the `RETRYABLE_FAILURES` is removed from the DB,
+    so the next migration uploads it again, and put back in `queue` (a `JobQueue`)
+    if there is one, with the metadata of its job if the queue kept it. That's
+    done up to `max_requeues` times per video. Other failures are permanent and
+    the video stays in the DB marked as failed. Videos missing from the response
+    are marked "missing" but left alone: they may have been deleted on purpose,
+    or belong to another channel.
+    The videos still processing are polled again after `interval` seconds,
+    doubled while nothing changes, up to `max_interval`.
+    """
+
+    def __init__(
+        self,
+        session,
+        youtube,
+        queue=None,
+        quota=None,
+        batch=50,
+        interval=30,
+        max_interval=600,
+        max_requeues=2,
+        sleep=time.sleep,
+    ):
+        self.session = session
+        self.youtube = youtube
+        self.queue = queue
+        self.quota = quota
+        self.batch = min(batch, 50)  # the most ids videos.list accepts
+        self.interval = interval
+        self.max_interval = max_interval
+        self.max_requeues = max_requeues
+        self.sleep = sleep
+
+    def _requeue(self, db, key, reason):
+        if reason not in RETRYABLE_FAILURES:
+            print(f"❌ YouTube won't process {db[key]} ({reason}), {key} won't be migrated again")
+            return False
+        if db.requeue(key) > self.max_requeues:
+            print(f"❌ YouTube failed to process {db[key]} ({reason}) again, giving up on {key}")
+            return False
+        print(f"❌ YouTube failed to process {db[key]} ({reason}), {key} will be migrated again")
+        del db[key]
+        if self.queue is not None:
+            video = get_media_item(self.session, _shorten(key, PHOTO_URL))
+            if not self.queue.requeue(video):
+                self.queue.add(video)
+        return True
+
+    def check(self):
+        """Poll the videos not verified yet once and return how many got each status"""
+        db = DB(self.session)
+        # copies linked to the first upload share its youtube id
+        keys = collections.defaultdict(list)
+        for key, value in db.unverified():
+            keys[_shorten(value, YOUTUBE_URL)].append(key)
+        ids = list(keys)
+        youtube = worker_youtube(self.youtube)
+        retry = Retry()
+        counts = collections.Counter()
+        with db.write_behind():
+            for start in range(0, len(ids), self.batch):
+                batch = ids[start : start + self.batch]
+                if self.quota is not None and not self.quota.reserve(LIST_COST):
+                    print("⏸️  No quota left to verify, checking again later")
+                    counts["processing"] += len(ids) - start
+                    break
+                response = retry.call(
+                    youtube.videos()
+                    .list(part="status,processingDetails", id=",".join(batch), maxResults=len(batch))
+                    .execute
+                )
+                items = {item["id"]: item for item in response.get("items", [])}
+                for video_id in batch:
+                    if video_id in items:
+                        status, reason = processing_status(items[video_id])
+                    else:
+                        status, reason = "missing", None
+                    counts[status] += 1
+                    if status == "processing":
+                        continue
+                    db.set_status(f"{YOUTUBE_URL}{video_id}", status, reason)
+                    if status in ("failed", "verified"):
+                        for key in keys[video_id]:
+                            if status == "failed" and self._requeue(db, key, reason):
+                                continue
+                            if self.queue is not None:
+                                self.queue.forget(_shorten(key, PHOTO_URL))
+                    elif status == "missing":
+                        print(f"⚠️  {YOUTUBE_URL}{video_id} wasn't found on YouTube")
+        return counts
+
+    def run(self, forever=False):
+        """
+        Poll until no video is left processing, or `forever` to also verify the
+        uploads of a migration running meanwhile. Return how many got each status.
+        """
+        interval = self.interval
+        totals = collections.Counter()
+        while True:
+            try:
+                counts = self.check()
+            except Exception as e:
+                if not forever:
+                    raise
+                print(f"⚠️  Verification failed: {e}")
+                counts = collections.Counter()
+            else:
+                totals.update(counts)
+                del totals["processing"]
+                if not forever and not counts["processing"]:
+                    return totals
+            if counts["verified"] or counts["failed"]:
+                interval = self.interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            if counts["processing"]:
+                print(f"⏳ {counts['processing']} videos still processing, checking again in {interval}s")
+            self.sleep(interval)
+
+    def start(self):
+        """Run forever in a background thread, verifying the uploads as they finish"""
+        thread = threading.Thread(target=self.run, kwargs={"forever": True}, daemon=True)
+        thread.start()
+        return thread
+
+
+# upper bounds of the buckets of the size histogram of `plan`
+SIZE_BUCKETS = (10 * 2**20, 100 * 2**20, 2**30, 4 * 2**30)
+
+
+def _human(nbytes):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}" if unit != "B" else f"{nbytes} B"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TiB"
+
+
+def plan(
+    session,
+    index,
+    bandwidth=None,
+    workers=16,
+    daily_quota=YOUTUBE_DAILY_QUOTA,
+    batch=500,
+):
+    """
+    Size the videos of the `index` not migrated yet and estimate their migration.
+
+    Sizes are fetched with `workers` concurrent HEAD requests and cached in the
+    index batch by batch, so an interrupted scan (or the next one) goes on where
+    it stopped. With `bandwidth` (bytes per second) the transfer time is estimated.
+    Return a dict with the totals, the size histogram and the estimates.
+    """
+    db = DB(session)
+    pending = []
+    migrated = 0
+    videos = iter(index)
+    while True:
+        videos_batch = [video for _, video in zip(range(batch), videos)]
+        if not videos_batch:
+            break
+        pending_batch = [v for v in videos_batch if v["productUrl"] not in db]
+        migrated += len(videos_batch) - len(pending_batch)
+        fetch_sizes(session, pending_batch, index=index, workers=workers)
+        pending.extend(pending_batch)
+        print(f"📏 {len(pending)} videos sized", end="\r")
+    print()
+
+    sizes = [video_size(v) for v in pending if video_size(v) is not None]
+    total = sum(sizes)
+    histogram = collections.Counter(bisect.bisect_left(SIZE_BUCKETS, size) for size in sizes)
+    bounds = ("0", *map(_human, SIZE_BUCKETS), "∞")
+    uploads_per_day = daily_quota // INSERT_COST
+    report = {
+        "videos": len(pending) + migrated,
+        "migrated": migrated,
+        "pending": len(pending),
+        "unknown_size": len(pending) - len(sizes),
+        "bytes": total,
+        "largest": max(sizes, default=0),
+        "median": _percentile(sizes, 0.5) or 0,
+        "histogram": {
+            f"{bounds[i]} - {bounds[i + 1]}": histogram[i] for i in range(len(bounds) - 1)
+        },
+        "uploads_per_day": uploads_per_day,
+        "quota_days": -(-len(pending) // uploads_per_day) if uploads_per_day else None,
+        "hours": total / bandwidth / 3600 if bandwidth else None,
+    }
+    return report
+
+
+def print_plan(report):
+    print(
+        f"🎞️  {report['videos']} videos, {report['migrated']} already migrated, "
+        f"{report['pending']} pending ({report['unknown_size']} of unknown size)"
+    )
+    print(
+        f"📦 {_human(report['bytes'])} to transfer, median {_human(report['median'])}, "
+        f"largest {_human(report['largest'])}"
+    )
+    width = max(report["histogram"].values(), default=0)
+    for bucket, count in report["histogram"].items():
+        bar = "█" * round(40 * count / width) if width else ""
+        print(f"   {bucket:>21} {count:>7} {bar}")
+    if report["hours"] is not None:
+        print(f"⏱️  {report['hours']:.1f} hours of transfer at the given bandwidth")
+    if report["quota_days"] is not None:
+        print(
+            f"📅 {report['quota_days']} days of YouTube quota "
+            f"({report['uploads_per_day']} uploads per day)"
+        )
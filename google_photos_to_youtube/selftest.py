@@ -0,0 +1,79 @@
+"""
+Checks of the package itself, apart from the core so that importing the core
+doesn't import them
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+__all__ = [
+    "test_import_time",
+]
+
+
+# modules the core needs anyway, to send the requests
+_REQUIRED_MODULES = (
+    "requests",
+    "httplib2",
+    "googleapiclient.errors",
+    "googleapiclient.http",
+)
+
+# modules the core must not import: they belong to the notebook, the OAuth flow
+# or the asyncio engine
+_HEAVY_MODULES = (
+    "IPython",
+    "ipywidgets",
+    "google_auth_oauthlib",
+    "googleapiclient.discovery",
+    "aiohttp",
+)
+
+
+def test_import_time(margin=0.5, runs=3):
+    """
+    Test that a new interpreter imports the package without loading any of the
+    heavy modules the workers don't need, and that the package itself adds at most
+    `margin` times what its required dependencies take to import (the best of
+    `runs`). The margin is relative, so it doesn't depend on the machine.
+    """
+    code = "\n".join(
+        [
+            "import sys, time",
+            "started = time.perf_counter()",
+            f"import {', '.join(_REQUIRED_MODULES)}",
+            "print(time.perf_counter() - started)",
+            "started = time.perf_counter()",
+            "import google_photos_to_youtube",
+            "print(time.perf_counter() - started)",
+            "print(*sys.modules)",
+        ]
+    )
+    best = None
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=Path(__file__).resolve().parent.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        required, own = float(output[0]), float(output[1])
+        if best is None or own < best[1]:
+            best = required, own
+    loaded = [name for name in _HEAVY_MODULES if name in output[2].split()]
+    if loaded:
+        print(f"❌ Importing the package loads {', '.join(loaded)}")
+        return False
+    required, own = best
+    if own > margin * required:
+        print(
+            f"❌ The package took {own * 1000:.0f} ms to import, more than {margin:.0%} "
+            f"of the {required * 1000:.0f} ms of its dependencies"
+        )
+        return False
+    print(
+        f"✅ The package imports in {own * 1000:.0f} ms, "
+        f"plus {required * 1000:.0f} ms of its dependencies"
+    )
+    return True
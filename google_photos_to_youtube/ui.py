@@ -0,0 +1,353 @@
+"""Widgets to browse the library and migrate videos from a notebook"""
+import html
+import threading
+
+import ipywidgets as widgets
+from IPython.display import Markdown, display
+
+from .core import (
+    DB,
+    DEFAULT_TAGS,
+    MAX_PAGE_SIZE,
+    _matching,
+    default_description,
+    default_title,
+    iter_pages,
+    migrate,
+    migrate_video,
+)
+
+__all__ = [
+    "video_block",
+    "load_page",
+    "VideoGrid",
+]
+
+
+def video_block(video, session, youtube):
+    title = widgets.Text(
+        value=video.get("description", ""),
+        description="Title",
+        disabled=False,
+    )
+    title.layout.width = "30em"
+    description = widgets.Textarea(
+        value=default_description(video),
+        description="Description",
+        disabled=False,
+    )
+    description.layout.height = "6em"
+    description.layout.width = "30em"
+    privacy = widgets.Dropdown(
+        options=["private", "unlisted", "public"],
+        value="private",
+        description='Privacy status:',
+        disabled=False,
+    )
+    privacy.layout.width = "30em"
+    tags = widgets.Text(
+        value=", ".join(DEFAULT_TAGS + ("",)),
+        description="Tags",
+        disabled=False,
+    )
+    tags.layout.width = "30em"
+    output = widgets.Output()
+    button = widgets.Button(description="Upload to youtube!")
+
+    thumb = Markdown(f"[![]({video['baseUrl']}=w300-h300-no)]({video['productUrl']})")
+    display(thumb, title, description, privacy, tags, button, output)
+
+    def on_button_clicked(b):
+        video_title = title.value.strip()
+        if not video_title:
+            title.placeholder = "This field is required"
+            try:
+                title.focus()
+            except AttributeError:
+                # requires ipython >=8.0
+                # https://github.com/jupyter-widgets/ipywidgets/commit/8b1abab
+                pass
+            return
+
+        with output:
+            # the size is set from the download itself, see migrate_video
+            bar = widgets.IntProgress(
+                value=0,
+                min=0,
+                max=1,
+                description="Uploading:",
+                bar_style="info",
+                orientation="horizontal",
+            )
+            display(bar)
+            response = migrate_video(
+                session,
+                youtube,
+                video,
+                title=video_title,
+                description=description.value,
+                tags=[t.strip() for t in tags.value.split(",")],
+                privacy_status=privacy.value,
+                progress=bar,
+            )
+            print(response)
+
+    button.on_click(on_button_clicked)
+
+
+def _library_pages(session, index, page_size, filters, album_id, where):
+    if index is None or filters or album_id:
+        return iter_pages(session, page_size, filters, album_id=album_id, where=where)
+    pages = index.pages(session, page_size)
+    if where is not None:
+        pages = (_matching(session, page, where, index) for page in pages)
+    return pages
+
+
+def load_page(
+    session,
+    youtube,
+    pages=None,
+    index=None,
+    page_size=MAX_PAGE_SIZE,
+    filters=None,
+    album_id=None,
+    where=None,
+):
+    """
+    Display a page of videos not migrated yet and a button to load the next one.
+
+    `pages` is an iterator of pages, by default the library listed with iter_pages
+    (or read from `index`, a `LibraryIndex`), so the next page is already being
+    fetched while the current one is displayed. The listing can be narrowed down
+    with `filters`, `album_id` and `where`, like in `iter_pages`.
+    Every page adds its widgets to the notebook, for large libraries see `VideoGrid`.
+    """
+    db = DB(session)
+    if pages is None:
+        pages = _library_pages(session, index, page_size, filters, album_id, where)
+    videos = next(pages, None)
+    if videos is None:
+        print("No more videos")
+        return
+    for video in videos:
+        item_url = video["productUrl"]
+        if item_url not in db:
+            video_block(video, session, youtube)
+
+    button = widgets.Button(description="Load more...")
+    output = widgets.Output()
+
+    def next_page(b):
+        button.close()
+        with output:
+            load_page(session, youtube, pages=pages)
+
+    button.on_click(next_page)
+    display(output, button)
+
+
+class VideoGrid:
+    """
+    Paginated grid of the videos not migrated yet, for large libraries.
+
+    Only one page of cards exists: `rows * columns` sets of widgets built once
+    and reused when the page changes, with thumbnails the browser loads lazily.
+    Pages of the library (`pages`, or listed and filtered like in `load_page`)
+    are fetched only as far as the grid is browsed. Videos selected across pages are
+    uploaded together with `migrate` running `workers` transfers, and "Edit"
+    shows the form of `video_block` to upload a single one with its own metadata.
+    """
+
+    def __init__(
+        self,
+        session,
+        youtube,
+        pages=None,
+        index=None,
+        rows=3,
+        columns=4,
+        workers=4,
+        page_size=MAX_PAGE_SIZE,
+        filters=None,
+        album_id=None,
+        where=None,
+    ):
+        self.session = session
+        self.youtube = youtube
+        self.index = index
+        self.workers = workers
+        self.db = DB(session)
+        if pages is None:
+            pages = _library_pages(session, index, page_size, filters, album_id, where)
+        self._pages = pages
+        self.videos = []  # listed so far and not migrated when listed
+        self.selected = {}  # video id -> video
+        self.page = 0
+        self.per_page = rows * columns
+        self._rendering = False
+
+        self._cards = [self._card() for _ in range(self.per_page)]
+        grid = widgets.GridBox(
+            [card["box"] for card in self._cards],
+            layout=widgets.Layout(grid_template_columns=f"repeat({columns}, 170px)"),
+        )
+        self.previous = widgets.Button(description="◀", layout=widgets.Layout(width="4em"))
+        self.next = widgets.Button(description="▶", layout=widgets.Layout(width="4em"))
+        self.status = widgets.Label()
+        self.previous.on_click(lambda b: self.show(self.page - 1))
+        self.next.on_click(lambda b: self.show(self.page + 1))
+        select_page = widgets.Button(description="Select page")
+        select_page.on_click(self._select_page)
+        clear = widgets.Button(description="Clear selection")
+        clear.on_click(self._clear)
+        self.privacy = widgets.Dropdown(
+            options=["private", "unlisted", "public"],
+            value="private",
+            description="Privacy status:",
+        )
+        self.upload = widgets.Button(description="Upload selected", button_style="primary")
+        self.upload.on_click(self._upload)
+        self.progress = widgets.IntProgress(
+            value=0, min=0, max=1, description="Uploading:", bar_style="info"
+        )
+        self.progress.layout.visibility = "hidden"
+        self.output = widgets.Output()
+        self.detail = widgets.Output()
+        self.widget = widgets.VBox(
+            [
+                widgets.HBox([self.previous, self.status, self.next]),
+                grid,
+                widgets.HBox([select_page, clear, self.privacy, self.upload]),
+                self.progress,
+                self.output,
+                self.detail,
+            ]
+        )
+        self.show(0)
+
+    def _ipython_display_(self):
+        display(self.widget)
+
+    def _card(self):
+        card = {
+            "thumb": widgets.HTML(),
+            "check": widgets.Checkbox(indent=False, layout=widgets.Layout(width="2em")),
+            "title": widgets.Label(layout=widgets.Layout(width="120px")),
+            "edit": widgets.Button(description="Edit", layout=widgets.Layout(width="4em")),
+            "video": None,
+        }
+        card["box"] = widgets.VBox(
+            [card["thumb"], widgets.HBox([card["check"], card["title"]]), card["edit"]]
+        )
+        card["check"].observe(lambda change: self._toggle(card, change["new"]), names="value")
+        card["edit"].on_click(lambda b: self._edit(card))
+        return card
+
+    def _load(self, count):
+        """List pages until there are `count` videos, or the library ends"""
+        while len(self.videos) < count and self._pages is not None:
+            page = next(self._pages, None)
+            if page is None:
+                self._pages = None
+                break
+            self.videos.extend(v for v in page if v["productUrl"] not in self.db)
+
+    def show(self, page):
+        # one more video tells if there's a next page
+        self._load((page + 1) * self.per_page + 1)
+        last = max(0, (len(self.videos) - 1) // self.per_page)
+        self.page = page = max(0, min(page, last))
+        visible = self.videos[page * self.per_page : (page + 1) * self.per_page]
+        if self.index is not None:
+            self.index.refresh(self.session, visible)
+        self._rendering = True
+        try:
+            for position, card in enumerate(self._cards):
+                video = visible[position] if position < len(visible) else None
+                card["video"] = video
+                card["box"].layout.visibility = "hidden" if video is None else "visible"
+                if video is None:
+                    continue
+                migrated = video["productUrl"] in self.db
+                card["thumb"].value = (
+                    f'<a href="{html.escape(video["productUrl"])}" target="_blank">'
+                    f'<img src="{html.escape(video["baseUrl"])}=w300-h300-no" loading="lazy" '
+                    'style="width:160px;height:160px;object-fit:cover"></a>'
+                )
+                card["title"].value = ("✅ " if migrated else "") + default_title(video)
+                card["check"].value = video["id"] in self.selected
+                card["check"].disabled = migrated
+        finally:
+            self._rendering = False
+        self._update_status()
+
+    def _update_status(self):
+        pages = f"{self.page + 1} of {max(1, -(-len(self.videos) // self.per_page))}"
+        if self._pages is not None:
+            pages += "+"
+        self.status.value = f"Page {pages}, {len(self.selected)} selected"
+        self.previous.disabled = self.page == 0
+        self.next.disabled = (self.page + 1) * self.per_page >= len(self.videos)
+
+    def _toggle(self, card, selected):
+        if self._rendering or card["video"] is None:
+            return
+        if selected:
+            self.selected[card["video"]["id"]] = card["video"]
+        else:
+            self.selected.pop(card["video"]["id"], None)
+        self._update_status()
+
+    def _select_page(self, b):
+        for card in self._cards:
+            if card["video"] is not None and not card["check"].disabled:
+                card["check"].value = True
+
+    def _clear(self, b):
+        self.selected.clear()
+        self.show(self.page)
+
+    def _edit(self, card):
+        self.detail.clear_output()
+        with self.detail:
+            video_block(card["video"], self.session, self.youtube)
+
+    def _upload(self, b):
+        videos = list(self.selected.values())
+        if not videos:
+            return
+        self.upload.disabled = True
+        self.progress.value = 0
+        self.progress.max = len(videos)
+        self.progress.layout.visibility = "visible"
+
+        def on_result(video, result):
+            # duplicates and failed downloads count too, they don't reach the upload
+            self.progress.value += 1
+
+        def run():
+            # in a thread, so the notebook stays responsive while uploading
+            try:
+                results = migrate(
+                    self.session,
+                    self.youtube,
+                    videos=videos,
+                    workers=self.workers,
+                    privacy_status=self.privacy.value,
+                    on_result=on_result,
+                )
+            finally:
+                self.upload.disabled = False
+            # the ones migrated meanwhile were skipped
+            self.progress.value = self.progress.max
+            failed = [url for url, result in results.items() if isinstance(result, Exception)]
+            for video in videos:
+                if video["productUrl"] not in failed:
+                    self.selected.pop(video["id"], None)
+            self.output.append_stdout(
+                f"{len(results) - len(failed)} migrated, {len(failed)} failed\n"
+            )
+            self.show(self.page)
+
+        threading.Thread(target=run, daemon=True).start()